@@ -9,6 +9,8 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import logging.handlers
+import queue
 
 from mautrix.appservice import AppService
 from mautrix.types import EventType
@@ -20,21 +22,37 @@ from .puppet import PuppetManager
 
 import os
 
-_log_level = os.environ.get("RELAY_LOG_LEVEL", "INFO").upper()
-logging.basicConfig(
-    level=getattr(logging, _log_level, logging.INFO),
-    format="%(asctime)s [%(levelname)s] %(name)s — %(message)s",
-)
 log = logging.getLogger("relay")
 
 # Background cleanup interval (6 hours).
 _CLEANUP_INTERVAL = 6 * 3600
 
 
+def _configure_logging() -> logging.handlers.QueueListener:
+    """Route log records through a queue drained by a background thread.
+
+    Handlers on the root logger only enqueue, so a slow stderr consumer
+    never blocks the event loop.  The caller must stop the returned
+    listener to flush pending records on shutdown.
+    """
+    level_name = os.environ.get("RELAY_LOG_LEVEL", "INFO").upper()
+    stream = logging.StreamHandler()
+    stream.setFormatter(
+        logging.Formatter("%(asctime)s [%(levelname)s] %(name)s — %(message)s"),
+    )
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level_name, logging.INFO))
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, stream)
+    listener.start()
+    return listener
+
+
 async def main() -> None:
     """Create the :class:`AppService` and start the HTTP server."""
     config = RelayConfig.from_env()
-    log.info("Portal rooms: %s", config.portal_rooms)
+    log.info("Portal rooms: %s", dict(config.portal_rooms))
     log.info("Hub room: %s", config.hub_room_id)
 
     # Open the event ID mapping database.
@@ -68,6 +86,8 @@ async def main() -> None:
             await handler.handle_message(event)
         elif event.type == EventType.REACTION:
             await handler.handle_reaction(event)
+        elif event.type == EventType.ROOM_MEMBER:
+            handler.handle_member(event)
 
     # Ensure the bot has joined all rooms.
     log.info("Starting appservice on 0.0.0.0:8009")
@@ -80,14 +100,26 @@ async def main() -> None:
         except Exception:
             log.exception("Failed to join %s", room_id)
 
-    # Periodic cleanup of old event mappings.
+    # Periodic cleanup of old event mappings, on a dedicated connection so
+    # it doesn't serialize with relay writes.  The connection is opened
+    # inside the retry loop: a failure to open it is logged and retried on
+    # the next run instead of silently ending the task.
     async def cleanup_loop() -> None:
-        while True:
-            await asyncio.sleep(_CLEANUP_INTERVAL)
-            try:
-                await event_map.cleanup(max_age_days=30)
-            except Exception:
-                log.exception("Event map cleanup failed")
+        maint = None
+        try:
+            while True:
+                await asyncio.sleep(_CLEANUP_INTERVAL)
+                try:
+                    if maint is None:
+                        maint = await event_map.connect_maintenance()
+                    await event_map.cleanup(max_age_days=30, conn=maint)
+                    await event_map.optimize(conn=maint)
+                    await event_map.checkpoint(conn=maint)
+                except Exception:
+                    log.exception("Event map cleanup failed")
+        finally:
+            if maint is not None:
+                await maint.close()
 
     cleanup_task = asyncio.create_task(cleanup_loop())
 
@@ -97,9 +129,27 @@ async def main() -> None:
         log.info("Shutting down")
     finally:
         cleanup_task.cancel()
+        # Whatever ended the task, the appservice and database still close.
+        try:
+            await cleanup_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception("Event map cleanup task failed")
         await appservice.stop()
         await event_map.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    listener = _configure_logging()
+    try:
+        try:
+            import uvloop
+        except ImportError:
+            asyncio.run(main())
+        else:
+            # libuv-backed event loop: cheaper socket I/O for the aiohttp
+            # server and client.  Optional so local runs work without it.
+            uvloop.run(main())
+    finally:
+        listener.stop()
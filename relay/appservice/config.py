@@ -5,7 +5,9 @@ from __future__ import annotations
 import logging
 import os
 import sys
+from collections.abc import Mapping
 from dataclasses import dataclass
+from types import MappingProxyType
 
 log = logging.getLogger(__name__)
 
@@ -31,7 +33,7 @@ class RelayConfig:
     domain: str
     as_token: str
     hs_token: str
-    portal_rooms: dict[str, str]  # room_id -> label
+    portal_rooms: Mapping[str, str]  # room_id -> label (read-only)
     hub_room_id: str
     bot_localpart: str = "relay-bot"
     db_path: str = "/data/relay.db"
@@ -45,20 +47,25 @@ class RelayConfig:
             object.__setattr__(self, "double_puppet_map", {})
 
     @classmethod
-    def from_env(cls) -> RelayConfig:
+    def from_env(cls, env: Mapping[str, str] | None = None) -> RelayConfig:
         """Parse configuration from environment variables.
 
+        *env* defaults to :data:`os.environ`; pass a plain mapping to parse
+        without touching the process environment.
+
         Exits the process if required variables are missing or invalid.
         """
-        homeserver_url = _require("RELAY_HOMESERVER_URL")
-        domain = _require("RELAY_DOMAIN")
-        as_token = _require("RELAY_AS_TOKEN")
-        hs_token = _require("RELAY_HS_TOKEN")
-        hub_room_id = _require("RELAY_HUB_ROOM_ID")
-        portal_rooms = _parse_portal_rooms()
-        bot_localpart = os.environ.get("RELAY_BOT_LOCALPART", "relay-bot").strip()
-        db_path = os.environ.get("RELAY_DB_PATH", "/data/relay.db").strip()
-        double_puppet_map = _parse_double_puppets(domain)
+        if env is None:
+            env = os.environ
+        homeserver_url = _require(env, "RELAY_HOMESERVER_URL")
+        domain = _require(env, "RELAY_DOMAIN")
+        as_token = _require(env, "RELAY_AS_TOKEN")
+        hs_token = _require(env, "RELAY_HS_TOKEN")
+        hub_room_id = _require(env, "RELAY_HUB_ROOM_ID")
+        portal_rooms = _parse_portal_rooms(env)
+        bot_localpart = env.get("RELAY_BOT_LOCALPART", "relay-bot").strip()
+        db_path = env.get("RELAY_DB_PATH", "/data/relay.db").strip()
+        double_puppet_map = _parse_double_puppets(env, domain)
 
         return cls(
             homeserver_url=homeserver_url,
@@ -73,18 +80,18 @@ class RelayConfig:
         )
 
 
-def _require(var: str) -> str:
+def _require(env: Mapping[str, str], var: str) -> str:
     """Return the stripped value of *var*, or exit if empty/missing."""
-    value = os.environ.get(var, "").strip()
+    value = env.get(var, "").strip()
     if not value:
         log.error("%s is required", var)
         sys.exit(1)
     return value
 
 
-def _parse_portal_rooms() -> dict[str, str]:
-    """Parse ``RELAY_PORTAL_ROOMS`` into a ``{room_id: label}`` dict."""
-    raw = os.environ.get("RELAY_PORTAL_ROOMS", "").strip()
+def _parse_portal_rooms(env: Mapping[str, str]) -> Mapping[str, str]:
+    """Parse ``RELAY_PORTAL_ROOMS`` into a read-only ``{room_id: label}`` mapping."""
+    raw = env.get("RELAY_PORTAL_ROOMS", "").strip()
     if not raw:
         log.error("RELAY_PORTAL_ROOMS is required")
         sys.exit(1)
@@ -109,10 +116,10 @@ def _parse_portal_rooms() -> dict[str, str]:
         log.error("RELAY_PORTAL_ROOMS is required")
         sys.exit(1)
 
-    return portal_rooms
+    return MappingProxyType(portal_rooms)
 
 
-def _parse_double_puppets(domain: str) -> dict[str, list[str]]:
+def _parse_double_puppets(env: Mapping[str, str], domain: str) -> dict[str, list[str]]:
     """Parse ``RELAY_DOUBLE_PUPPETS`` into a ``{mxid: [puppet_mxid, ...]}`` dict.
 
     Format: ``user=puppet1,puppet2;user2=puppet3``
@@ -126,7 +133,7 @@ def _parse_double_puppets(domain: str) -> dict[str, list[str]]:
 
     Maps ``@nick:domain`` to ``[@signal_66eda24c-...:domain, @whatsapp_...:domain]``.
     """
-    raw = os.environ.get("RELAY_DOUBLE_PUPPETS", "").strip()
+    raw = env.get("RELAY_DOUBLE_PUPPETS", "").strip()
     if not raw:
         return {}
 
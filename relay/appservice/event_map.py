@@ -10,20 +10,28 @@ ideal for a single-process bot on a Raspberry Pi.
 
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import logging
 import time
-import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 
 import aiosqlite
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
 log = logging.getLogger(__name__)
 
-_SCHEMA = """\
-CREATE TABLE IF NOT EXISTS event_groups (
-    group_id   TEXT PRIMARY KEY,
-    created_at REAL NOT NULL
-);
-CREATE TABLE IF NOT EXISTS event_group_events (
+# A queued store: ((room_id, event_id) pairs, created_at, waiter or None).
+_WriteJob = tuple[list[tuple[str, str]], float, "asyncio.Future[None] | None"]
+
+# WITHOUT ROWID clusters rows on (group_id, room_id), so the second half of
+# a lookup lands on the row itself.  Secondary indexes then carry the primary
+# key, which makes the UNIQUE (event_id) index cover event_id -> group_id.
+_EVENTS_TABLE = """\
+CREATE TABLE IF NOT EXISTS {name} (
     group_id   TEXT NOT NULL,
     room_id    TEXT NOT NULL,
     event_id   TEXT NOT NULL,
@@ -31,9 +39,16 @@ CREATE TABLE IF NOT EXISTS event_group_events (
     PRIMARY KEY (group_id, room_id),
     UNIQUE (event_id),
     FOREIGN KEY (group_id) REFERENCES event_groups(group_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+"""
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS event_groups (
+    group_id   TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
 );
-CREATE INDEX IF NOT EXISTS idx_event_group_events_event
-    ON event_group_events (event_id);
+""" + _EVENTS_TABLE.format(name="event_group_events") + """\
+DROP INDEX IF EXISTS idx_event_group_events_event;
 CREATE INDEX IF NOT EXISTS idx_event_group_events_created
     ON event_group_events (created_at);
 """
@@ -47,24 +62,72 @@ class EventMap:
             in-memory use (tests).
     """
 
+    #: Maximum number of ``lookup()`` results kept in memory.
+    LOOKUP_CACHE_SIZE: int = 4096
+
+    #: Maximum number of queued stores committed in one transaction.
+    WRITE_BATCH_SIZE: int = 64
+
+    #: Free pages returned to the filesystem per :meth:`cleanup` run.
+    VACUUM_PAGES: int = 100
+
+    #: Bytes of the database file to memory-map for reads.
+    MMAP_SIZE: int = 64 * 1024 * 1024
+
     def __init__(self, db_path: str) -> None:
         self._db_path = db_path
-        self._db: aiosqlite.Connection | None = None
+        # Set by open(); using the store before then raises AttributeError.
+        self._db: aiosqlite.Connection
+        self._is_open = False
+        # (source_event_id, target_room_id) -> target_event_id | None, in
+        # LRU order.  Misses are cached too; writes invalidate affected keys.
+        self._lookup_cache: OrderedDict[tuple[str, str], str | None] = OrderedDict()
+        # Bumped on every invalidation.  A read that started under an older
+        # generation may predate the write that invalidated it, so its
+        # result is returned but not cached.
+        self._cache_generation = 0
+        # Group commit: stores are queued for a single writer task, and the
+        # lock keeps other write transactions (cleanup) from interleaving.
+        self._write_queue: asyncio.Queue[_WriteJob | None] = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+        self._writer: asyncio.Task[None] | None = None
 
     async def open(self) -> None:
         """Open the database and create the schema."""
         self._db = await aiosqlite.connect(self._db_path)
+        self._is_open = True
+        # auto_vacuum only takes effect if set before the first table is
+        # created; existing non-incremental databases keep their mode.
+        await self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
         await self._db.execute("PRAGMA journal_mode=WAL")
+        # Needed for ON DELETE CASCADE from event_groups in cleanup().
+        await self._db.execute("PRAGMA foreign_keys=ON")
+        # NORMAL is crash-safe under WAL; at worst the last commit is lost,
+        # which only costs a reply/reaction mapping.
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute("PRAGMA busy_timeout=30000")
+        await self._db.execute("PRAGMA temp_store=MEMORY")
+        await self._db.execute("PRAGMA cache_size=-8000")  # 8 MiB
+        # Serve reads straight from the page cache's mapping instead of
+        # copying through read(); the map file is the (small) main DB.
+        await self._db.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+        await self._db.execute("PRAGMA wal_autocheckpoint=1000")
         await self._db.executescript(_SCHEMA)
         await self._db.commit()
+        await self._maybe_rebuild_events_table()
         await self._maybe_migrate_legacy()
+        self._writer = asyncio.create_task(self._write_loop())
         log.info("Event map database opened: %s", self._db_path)
 
     async def close(self) -> None:
-        """Close the database connection."""
-        if self._db:
+        """Flush pending stores and close the database connection."""
+        if self._writer is not None:
+            self._write_queue.put_nowait(None)
+            await self._writer
+            self._writer = None
+        if self._is_open:
+            self._is_open = False
             await self._db.close()
-            self._db = None
 
     async def store(
         self,
@@ -80,12 +143,45 @@ class EventMap:
         The mapping is stored as an event group so lookups can work in any
         direction (replies/reactions from any room).
         """
-        assert self._db is not None
+        await self.store_many(
+            source_event_id,
+            source_room_id,
+            [(target_event_id, target_room_id)],
+            created_at=created_at,
+        )
+
+    async def store_many(
+        self,
+        source_event_id: str,
+        source_room_id: str,
+        pairs: list[tuple[str, str]],
+        *,
+        created_at: float | None = None,
+    ) -> None:
+        """Store mappings from one source event to several targets at once.
+
+        *pairs* is a list of ``(target_event_id, target_room_id)`` tuples.
+        All rows for one call land in the same transaction, and while the
+        background writer is running, calls that arrive during a commit are
+        grouped into the next one — so a burst costs one fsync, not one per
+        message.
+        """
+        if not pairs:
+            return
         now = time.time() if created_at is None else created_at
-        group_id = await self._ensure_group(source_event_id, target_event_id, now)
-        await self._upsert_event(group_id, source_room_id, source_event_id, now)
-        await self._upsert_event(group_id, target_room_id, target_event_id, now)
-        await self._db.commit()
+        events = [(source_room_id, source_event_id)]
+        events.extend(
+            (target_room_id, target_event_id)
+            for target_event_id, target_room_id in pairs
+        )
+        if self._writer is None:
+            await self._commit_batch([(events, now, None)])
+            return
+        if self._writer.done():
+            raise RuntimeError("event map writer is not running")
+        done: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((events, now, done))
+        await done
 
     async def lookup(
         self,
@@ -93,122 +189,365 @@ class EventMap:
         target_room_id: str,
     ) -> str | None:
         """Look up the target event ID for a source event in a specific room."""
-        assert self._db is not None
-        group_row = await self._db.execute(
-            "SELECT group_id FROM event_group_events WHERE event_id = ?",
-            (source_event_id,),
-        )
-        group = await group_row.fetchone()
-        if not group:
-            return None
+        key = (source_event_id, target_room_id)
+        if key in self._lookup_cache:
+            self._lookup_cache.move_to_end(key)
+            return self._lookup_cache[key]
+        generation = self._cache_generation
+        result = await self._lookup_db(source_event_id, target_room_id)
+        self._cache_lookup(key, result, generation)
+        return result
+
+    async def has_event(self, event_id: str) -> bool:
+        """Return True if *event_id* belongs to any stored event group."""
         cursor = await self._db.execute(
-            "SELECT event_id FROM event_group_events "
-            "WHERE group_id = ? AND room_id = ?",
-            (group[0], target_room_id),
+            "SELECT 1 FROM event_group_events WHERE event_id = ? LIMIT 1",
+            (event_id,),
         )
-        row = await cursor.fetchone()
-        return row[0] if row else None
+        return await cursor.fetchone() is not None
 
-    async def cleanup(self, max_age_days: int = 30) -> int:
-        """Delete mappings older than *max_age_days*.
+    async def lookup_many(
+        self,
+        source_event_id: str,
+        target_rooms: Iterable[str],
+    ) -> dict[str, str]:
+        """Look up the target event IDs for a source event in several rooms.
 
-        Returns the number of rows deleted.
+        Returns a ``{room_id: event_id}`` dict containing only the rooms that
+        have a mapping.  Rooms not already cached are resolved with a single
+        query.
         """
-        assert self._db is not None
-        cutoff = time.time() - (max_age_days * 86400)
+        found: dict[str, str] = {}
+        missing: list[str] = []
+        for room_id in target_rooms:
+            key = (source_event_id, room_id)
+            if key in self._lookup_cache:
+                self._lookup_cache.move_to_end(key)
+                cached = self._lookup_cache[key]
+                if cached is not None:
+                    found[room_id] = cached
+            else:
+                missing.append(room_id)
+        if not missing:
+            return found
+
+        generation = self._cache_generation
+        placeholders = ", ".join("?" * len(missing))
         cursor = await self._db.execute(
-            "DELETE FROM event_group_events WHERE created_at < ?",
-            (cutoff,),
+            "SELECT target.room_id, target.event_id FROM event_group_events AS source "
+            "JOIN event_group_events AS target ON target.group_id = source.group_id "
+            f"WHERE source.event_id = ? AND target.room_id IN ({placeholders})",
+            (source_event_id, *missing),
         )
-        await self._db.commit()
-        removed = cursor.rowcount
-        await self._db.execute(
-            "DELETE FROM event_groups "
-            "WHERE group_id NOT IN (SELECT DISTINCT group_id FROM event_group_events)",
-        )
-        await self._db.commit()
+        fetched = dict(await cursor.fetchall())
+        for room_id in missing:
+            self._cache_lookup(
+                (source_event_id, room_id), fetched.get(room_id), generation,
+            )
+        found.update(fetched)
+        return found
+
+    async def connect_maintenance(self) -> aiosqlite.Connection:
+        """Open a second connection for periodic maintenance.
+
+        Running :meth:`cleanup`, :meth:`optimize` and :meth:`checkpoint` on
+        their own connection lets them proceed under WAL without holding up
+        stores on the main one.  The caller owns (and closes) the connection.
+        """
+        conn = await aiosqlite.connect(self._db_path)
+        await conn.execute("PRAGMA busy_timeout=30000")
+        await conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    async def cleanup(
+        self,
+        max_age_days: int = 30,
+        *,
+        conn: aiosqlite.Connection | None = None,
+    ) -> int:
+        """Delete event groups whose events are all older than *max_age_days*.
+
+        Groups are deleted directly and ``ON DELETE CASCADE`` removes their
+        events in the same statement.  A group that gained a newer event
+        (e.g. through a merge) is kept until that event ages out too.
+        Afterwards a bounded ``incremental_vacuum`` hands freed pages back to
+        the filesystem without a full ``VACUUM``.
+
+        Pass *conn* (see :meth:`connect_maintenance`) to run on a separate
+        connection; otherwise the main connection is used and stores wait.
+
+        Returns the number of event mappings deleted.
+        """
+        db = conn or self._db
+        cutoff = time.time() - (max_age_days * 86400)
+        # A separate connection has its own transaction, so only the shared
+        # main connection needs to be kept clear of the writer's batches.
+        lock = self._write_lock if db is self._db else contextlib.nullcontext()
+        async with lock:
+            changes_before = db.total_changes
+            cursor = await db.execute(
+                "DELETE FROM event_groups WHERE group_id IN "
+                "(SELECT group_id FROM event_group_events WHERE created_at < ?) "
+                "AND NOT EXISTS (SELECT 1 FROM event_group_events AS recent "
+                "WHERE recent.group_id = event_groups.group_id "
+                "AND recent.created_at >= ?)",
+                (cutoff, cutoff),
+            )
+            await db.commit()
+            # total_changes counts the cascaded event rows; rowcount only
+            # counts the groups themselves.
+            removed = db.total_changes - changes_before - cursor.rowcount
+            self._forget_all()
+            # executescript steps the pragma to completion; execute() would
+            # free only a single page.
+            await db.executescript(
+                f"PRAGMA incremental_vacuum({self.VACUUM_PAGES});",
+            )
         if removed:
             log.info("Cleaned up %d old event mappings", removed)
         return removed
 
+    async def optimize(self, *, conn: aiosqlite.Connection | None = None) -> None:
+        """Run ``PRAGMA optimize`` to refresh query planner statistics."""
+        await (conn or self._db).execute("PRAGMA optimize")
+
+    async def checkpoint(self, *, conn: aiosqlite.Connection | None = None) -> None:
+        """Checkpoint the WAL and truncate it so the file stays bounded."""
+        await (conn or self._db).execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
     # ------------------------------------------------------------------
     # Internal helpers
     # ------------------------------------------------------------------
 
-    async def _upsert_event(
-        self,
-        group_id: str,
-        room_id: str,
-        event_id: str,
-        created_at: float,
-    ) -> None:
-        assert self._db is not None
-        await self._db.execute(
-            "INSERT OR REPLACE INTO event_group_events "
+    async def _write_loop(self) -> None:
+        """Group queued stores into shared transactions until closed.
+
+        Each batch takes whatever was queued while the previous commit was
+        in flight (up to :attr:`WRITE_BATCH_SIZE` jobs), so idle stores are
+        committed immediately and bursts coalesce naturally.
+
+        If the writer stops — closed, or a failure it cannot recover from —
+        any stores still queued are failed rather than left waiting.
+        """
+        try:
+            while True:
+                job = await self._write_queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                stopping = False
+                while len(batch) < self.WRITE_BATCH_SIZE and not self._write_queue.empty():
+                    job = self._write_queue.get_nowait()
+                    if job is None:
+                        stopping = True
+                        break
+                    batch.append(job)
+                await self._commit_batch(batch)
+                if stopping:
+                    return
+        except Exception:
+            log.exception("Event map writer failed; further stores will be rejected")
+        finally:
+            while not self._write_queue.empty():
+                job = self._write_queue.get_nowait()
+                if job is not None and job[2] is not None and not job[2].done():
+                    job[2].set_exception(RuntimeError("event map writer is not running"))
+
+    async def _commit_batch(self, batch: list[_WriteJob]) -> None:
+        """Write *batch* in one transaction, isolating each job in a savepoint.
+
+        A job whose writes fail is rolled back on its own and its waiter gets
+        the exception; the rest of the batch still commits.  Jobs without a
+        waiter (direct, writer-less calls) re-raise instead.  Every waiter is
+        settled even if the rollback itself fails.
+        """
+        errors: list[BaseException | None] = []
+        try:
+            async with self._write_lock:
+                try:
+                    await self._db.execute("BEGIN IMMEDIATE")
+                    for events, now, _ in batch:
+                        await self._db.execute("SAVEPOINT store_job")
+                        try:
+                            await self._write_events(events, now)
+                        except Exception as exc:
+                            await self._db.execute("ROLLBACK TO store_job")
+                            errors.append(exc)
+                        else:
+                            errors.append(None)
+                        await self._db.execute("RELEASE store_job")
+                    await self._db.commit()
+                except BaseException as exc:
+                    errors = [exc] * len(batch)
+                    await self._db.rollback()
+        finally:
+            if len(errors) < len(batch):
+                # Interrupted before the transaction started (e.g. cancelled
+                # while waiting for the lock): nothing was written.
+                errors = [RuntimeError("event map write was interrupted")] * len(batch)
+            for (events, _, done), error in zip(batch, errors):
+                if error is None:
+                    self._forget(events)
+                if done is None:
+                    if error is not None:
+                        raise error
+                elif not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(error)
+
+    async def _write_events(self, events: list[tuple[str, str]], now: float) -> None:
+        """Insert *events* (``(room_id, event_id)`` pairs) as one group."""
+        # Group IDs are derived from their first members, so a brand-new
+        # fan-out needs no SELECT: both inserts go through blind.
+        group_id = min(event_id for _, event_id in events)
+        cursor = await self._db.execute(
+            "INSERT OR IGNORE INTO event_groups (group_id, created_at) VALUES (?, ?)",
+            (group_id, now),
+        )
+        if cursor.rowcount == 0:
+            # Rejoining a surviving group: its other members may have
+            # cached misses for these rooms.
+            self._forget_all()
+        cursor = await self._db.executemany(
+            "INSERT OR IGNORE INTO event_group_events "
             "(group_id, room_id, event_id, created_at) VALUES (?, ?, ?, ?)",
-            (group_id, room_id, event_id, created_at),
+            [(group_id, room_id, event_id, now) for room_id, event_id in events],
         )
+        if cursor.rowcount != len(events):
+            # An event is already mapped (or its room slot is taken) —
+            # resolve the existing group(s) and overwrite.  This can
+            # change lookups for any member of the merged groups.
+            self._forget_all()
+            group_id = await self._ensure_group(
+                [event_id for _, event_id in events], group_id,
+            )
+            await self._db.executemany(
+                "INSERT OR REPLACE INTO event_group_events "
+                "(group_id, room_id, event_id, created_at) VALUES (?, ?, ?, ?)",
+                [(group_id, room_id, event_id, now) for room_id, event_id in events],
+            )
+
+    def _forget(self, events: list[tuple[str, str]]) -> None:
+        """Drop cached lookups that a committed write of *events* can change.
+
+        Reshaped groups already cleared the whole cache; otherwise the group
+        is new and only spans these rooms, so only (member, room) pairs among
+        the stored events can have changed.
+        """
+        self._cache_generation += 1
+        for _, event_id in events:
+            for room_id, _ in events:
+                self._lookup_cache.pop((event_id, room_id), None)
+
+    def _forget_all(self) -> None:
+        """Drop every cached lookup (groups were merged or deleted)."""
+        self._cache_generation += 1
+        self._lookup_cache.clear()
+
+    def _cache_lookup(
+        self, key: tuple[str, str], result: str | None, generation: int,
+    ) -> None:
+        """Cache *result* unless the cache was invalidated since *generation*."""
+        if generation != self._cache_generation:
+            return
+        self._lookup_cache[key] = result
+        if len(self._lookup_cache) > self.LOOKUP_CACHE_SIZE:
+            self._lookup_cache.popitem(last=False)
 
-    async def _ensure_group(
+    async def _lookup_db(
         self,
         source_event_id: str,
-        target_event_id: str,
-        created_at: float,
-    ) -> str:
-        assert self._db is not None
+        target_room_id: str,
+    ) -> str | None:
+        # One statement: the event_id index resolves the group without a
+        # table fetch, then the primary key lands on the target row.
         cursor = await self._db.execute(
-            "SELECT group_id FROM event_group_events WHERE event_id IN (?, ?)",
-            (source_event_id, target_event_id),
+            "SELECT target.event_id FROM event_group_events AS source "
+            "JOIN event_group_events AS target "
+            "ON target.group_id = source.group_id AND target.room_id = ? "
+            "WHERE source.event_id = ?",
+            (target_room_id, source_event_id),
+        )
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def _ensure_group(self, event_ids: list[str], candidate: str) -> str:
+        """Slow path: return the group shared by *event_ids*, merging if needed.
+
+        *candidate* is the derived group ID already inserted by the fast
+        path; it is dropped again if another group wins and it is left empty.
+        """
+        placeholders = ", ".join("?" * len(event_ids))
+        cursor = await self._db.execute(
+            "SELECT group_id FROM event_group_events "
+            f"WHERE event_id IN ({placeholders})",
+            event_ids,
         )
         group_ids = [row[0] for row in await cursor.fetchall()]
         group_ids = list(dict.fromkeys(group_ids))  # stable dedupe
+        # Prefer an established group over the freshly derived one.
+        group_ids.sort(key=lambda g: g == candidate)
 
         if not group_ids:
-            group_id = uuid.uuid4().hex
-            await self._db.execute(
-                "INSERT INTO event_groups (group_id, created_at) VALUES (?, ?)",
-                (group_id, created_at),
-            )
-            return group_id
+            return candidate
 
         group_id = group_ids[0]
         if len(group_ids) > 1:
             await self._merge_groups(group_id, group_ids[1:])
+        if candidate != group_id:
+            await self._db.execute(
+                "DELETE FROM event_groups WHERE group_id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM event_group_events WHERE group_id = ?)",
+                (candidate, candidate),
+            )
         return group_id
 
     async def _merge_groups(self, target_group: str, other_groups: list[str]) -> None:
-        assert self._db is not None
-        for group_id in other_groups:
-            cursor = await self._db.execute(
-                "SELECT room_id, event_id, created_at FROM event_group_events "
-                "WHERE group_id = ?",
-                (group_id,),
-            )
-            rows = await cursor.fetchall()
-            for room_id, event_id, created_at in rows:
-                existing = await self._db.execute(
-                    "SELECT 1 FROM event_group_events WHERE group_id = ? AND room_id = ?",
-                    (target_group, room_id),
-                )
-                if await existing.fetchone():
-                    continue
-                await self._db.execute(
-                    "INSERT OR IGNORE INTO event_group_events "
-                    "(group_id, room_id, event_id, created_at) VALUES (?, ?, ?, ?)",
-                    (target_group, room_id, event_id, created_at),
-                )
-            await self._db.execute(
-                "DELETE FROM event_group_events WHERE group_id = ?",
-                (group_id,),
-            )
-            await self._db.execute(
-                "DELETE FROM event_groups WHERE group_id = ?",
-                (group_id,),
-            )
-        await self._db.commit()
+        """Move every event of *other_groups* into *target_group*.
+
+        Events whose room already has an entry in *target_group* are dropped
+        (the target's event wins).
+        """
+        placeholders = ", ".join("?" * len(other_groups))
+        await self._db.execute(
+            "UPDATE OR IGNORE event_group_events SET group_id = ? "
+            f"WHERE group_id IN ({placeholders})",
+            (target_group, *other_groups),
+        )
+        await self._db.execute(
+            f"DELETE FROM event_group_events WHERE group_id IN ({placeholders})",
+            other_groups,
+        )
+        await self._db.execute(
+            f"DELETE FROM event_groups WHERE group_id IN ({placeholders})",
+            other_groups,
+        )
+
+    async def _maybe_rebuild_events_table(self) -> None:
+        """Rebuild a rowid ``event_group_events`` table as WITHOUT ROWID."""
+        cursor = await self._db.execute(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'event_group_events'",
+        )
+        row = await cursor.fetchone()
+        if "WITHOUT ROWID" in row[0].upper():
+            return
+        await self._db.executescript(
+            "BEGIN;"
+            + _EVENTS_TABLE.format(name="event_group_events_new")
+            + "INSERT INTO event_group_events_new "
+            "SELECT group_id, room_id, event_id, created_at FROM event_group_events;"
+            "DROP TABLE event_group_events;"
+            "ALTER TABLE event_group_events_new RENAME TO event_group_events;"
+            "CREATE INDEX IF NOT EXISTS idx_event_group_events_created "
+            "ON event_group_events (created_at);"
+            "COMMIT;",
+        )
+        log.info("Rebuilt event_group_events as a WITHOUT ROWID table")
 
     async def _maybe_migrate_legacy(self) -> None:
-        assert self._db is not None
         legacy_exists = await self._table_exists("event_map")
         if not legacy_exists:
             return
@@ -235,7 +574,6 @@ class EventMap:
         log.info("Migrated %d legacy event mappings", len(rows))
 
     async def _table_exists(self, table: str) -> bool:
-        assert self._db is not None
         cursor = await self._db.execute(
             "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
             (table,),
@@ -7,12 +7,20 @@ via event ID mapping.
 
 from __future__ import annotations
 
+import asyncio
 import copy
 import logging
 import time
+from collections import OrderedDict
 from typing import TYPE_CHECKING
 
-from mautrix.types import EventType
+from mautrix.types import (
+    EventType,
+    InReplyTo,
+    MessageType,
+    RelatesTo,
+    TextMessageEventContent,
+)
 
 from .loop_prevention import (
     platform_label,
@@ -21,6 +29,8 @@ from .loop_prevention import (
 )
 
 if TYPE_CHECKING:
+    from collections.abc import Mapping
+
     from mautrix.appservice import AppService
 
     from .config import RelayConfig
@@ -44,11 +54,18 @@ class RelayHandler:
     #: How long (seconds) to cache a sender's profile before re-fetching.
     PROFILE_CACHE_TTL: float = 60.0
 
+    #: Maximum number of ``(sender, room)`` profiles kept in memory.
+    PROFILE_CACHE_SIZE: int = 1024
+
+    #: Maximum number of recently handled event IDs remembered, so an event
+    #: delivered twice is relayed only once.
+    DEDUPE_CACHE_SIZE: int = 4096
+
     def __init__(
         self,
         appservice: AppService,
         puppet_manager: PuppetManager,
-        portal_rooms: dict[str, str],
+        portal_rooms: Mapping[str, str],
         hub_room_id: str,
         event_map: EventMap | None = None,
         double_puppet_map: dict[str, list[str]] | None = None,
@@ -56,11 +73,42 @@ class RelayHandler:
         self._appservice = appservice
         self._puppet_manager = puppet_manager
         self._portal_rooms = portal_rooms
+        # Fan-out targets are fixed for the process lifetime, so build them
+        # once rather than filtering the portal dict on every event.
+        self._all_portals: tuple[str, ...] = tuple(portal_rooms)
+        self._others: dict[str, tuple[str, ...]] = {
+            rid: tuple(r for r in portal_rooms if r != rid) for rid in portal_rooms
+        }
+        # Portal room ID -> lowercase platform name (e.g. "whatsapp").
+        self._portal_platforms: dict[str, str] = {
+            rid: label.lower() for rid, label in portal_rooms.items()
+        }
         self._hub_room_id = hub_room_id
         self._event_map = event_map
         self._double_puppet_map = double_puppet_map or {}
+        # Double puppet MXID -> the real user it stands in for, so a puppet's
+        # profile change can invalidate the real user's cached profile.
+        self._double_puppet_owners: dict[str, str] = {
+            puppet: user
+            for user, puppets in self._double_puppet_map.items()
+            for puppet in puppets
+        }
         # (sender MXID, room_id|None) -> (display_name, avatar_url, fetched_at)
-        self._profile_cache: dict[tuple[str, str | None], tuple[str, str | None, float]] = {}
+        # LRU-bounded; member events evict entries as profiles change.
+        self._profile_cache: OrderedDict[
+            tuple[str, str | None], tuple[str, str | None, float]
+        ] = OrderedDict()
+        # Profile fetches currently in flight, so a burst of messages from
+        # one sender shares a single homeserver round-trip.
+        self._profile_inflight: dict[
+            tuple[str, str | None], asyncio.Future[tuple[str, str | None]]
+        ] = {}
+        # Bumped by handle_member().  A fetch that started under an older
+        # generation may have read the profile the member event replaced,
+        # so its result is returned but not cached.
+        self._profile_generation = 0
+        # Recently handled event IDs (LRU; values unused).
+        self._seen_events: OrderedDict[str, None] = OrderedDict()
 
     # ------------------------------------------------------------------
     # Public API
@@ -72,101 +120,134 @@ class RelayHandler:
         Handles portal->hub, hub->portals, and portal->portal cross-relay.
         Supports both text messages and media (images, files, video, audio).
         """
+        # Cheapest rejections first: the room, then our own echo, and only
+        # then anything that touches the content.
         room_id: str = event.room_id
+        # One probe answers both "is this a portal?" and "which platform?".
+        portal_platform = self._portal_platforms.get(room_id)
+        if portal_platform is None and room_id != self._hub_room_id:
+            # Unrelated room -> ignore silently.
+            return
+
         sender: str = event.sender
-        body: str = event.content.body or ""
         bot_mxid: str = self._appservice.bot_mxid
-        is_media = self._is_media_content(event.content)
+        if sender == bot_mxid:
+            return
 
+        body: str = event.content.body or ""
         # An event with no body AND no media URL has nothing to relay.
-        if not body and not is_media:
+        if not body and not self._is_media_content(event.content):
             return
 
-        if room_id in self._portal_rooms:
+        if portal_platform is not None:
             if should_ignore_in_portal(sender, body, bot_mxid):
                 return
-            await self._relay_from_portal(event)
-
-        elif room_id == self._hub_room_id:
+            if self._is_duplicate(event.event_id):
+                return
+            await self._relay_from_portal(event, portal_platform)
+        else:
             if should_ignore_in_hub(sender, body, bot_mxid):
                 return
+            if self._is_duplicate(event.event_id):
+                return
             await self._relay_from_hub(event)
 
-        # Unrelated room -> ignore silently.
+    def handle_member(self, event) -> None:
+        """Forget cached profiles affected by an ``m.room.member`` event.
+
+        A member event carries the user's new per-room display name and
+        avatar, so the cached copy for that room (and the global fallback)
+        is stale, and so is any fetch for it still in flight.  If the user is
+        a double puppet, the real user it stands in for is invalidated as
+        well.
+        """
+        user_id: str | None = getattr(event, "state_key", None)
+        if not user_id:
+            return
+        room_id: str = event.room_id
+        self._profile_generation += 1
+        for mxid in (user_id, self._double_puppet_owners.get(user_id)):
+            if mxid is None:
+                continue
+            for cache_key in ((mxid, room_id), (mxid, None)):
+                self._profile_cache.pop(cache_key, None)
+                # Later callers start a fresh fetch rather than joining one
+                # that may predate this change.
+                self._profile_inflight.pop(cache_key, None)
 
     # ------------------------------------------------------------------
     # Internals
     # ------------------------------------------------------------------
 
-    async def _relay_from_portal(self, event) -> None:
+    async def _relay_from_portal(self, event, platform: str) -> None:
         """Relay a portal message to the hub and to other portal rooms."""
         sender: str = event.sender
         room_id: str = event.room_id
-        source_event_id: str = event.event_id
         display_name, avatar_url = await self._get_sender_profile(sender, room_id)
-        source_label = self._portal_rooms[room_id]
-        platform = source_label.lower()
-        reply_to = self._get_reply_to(event)
 
-        # Portal -> Hub
-        target_evt = await self._send_as_puppet(
+        # Portal -> Hub, plus Portal -> Other portals (cross-relay).
+        await self._fan_out(
+            event,
+            (self._hub_room_id, *self._others[room_id]),
             platform=platform,
-            sender=sender,
             display_name=display_name,
             avatar_url=avatar_url,
-            room_id=self._hub_room_id,
-            content=event.content,
-            reply_to_source=reply_to,
-            target_room_id=self._hub_room_id,
         )
-        if target_evt and self._event_map:
-            await self._event_map.store(
-                source_event_id, room_id, target_evt, self._hub_room_id,
-            )
-
-        # Portal -> Other portals (cross-relay)
-        for portal_id in self._portal_rooms:
-            if portal_id == room_id:
-                continue
-            target_evt = await self._send_as_puppet(
-                platform=platform,
-                sender=sender,
-                display_name=display_name,
-                avatar_url=avatar_url,
-                room_id=portal_id,
-                content=event.content,
-                reply_to_source=reply_to,
-                target_room_id=portal_id,
-            )
-            if target_evt and self._event_map:
-                await self._event_map.store(
-                    source_event_id, room_id, target_evt, portal_id,
-                )
 
     async def _relay_from_hub(self, event) -> None:
         """Fan out a hub message to all portal rooms."""
         sender: str = event.sender
-        source_event_id: str = event.event_id
         room_id: str = event.room_id
         display_name, avatar_url = await self._get_sender_profile(sender, room_id)
         platform = platform_label(sender).lower()
-        reply_to = self._get_reply_to(event)
 
-        for portal_id in self._portal_rooms:
-            target_evt = await self._send_as_puppet(
-                platform=platform,
-                sender=sender,
-                display_name=display_name,
-                avatar_url=avatar_url,
-                room_id=portal_id,
-                content=event.content,
-                reply_to_source=reply_to,
-                target_room_id=portal_id,
-            )
-            if target_evt and self._event_map:
-                await self._event_map.store(
-                    source_event_id, room_id, target_evt, portal_id,
+        await self._fan_out(
+            event,
+            self._all_portals,
+            platform=platform,
+            display_name=display_name,
+            avatar_url=avatar_url,
+        )
+
+    async def _fan_out(
+        self,
+        event,
+        targets: tuple[str, ...],
+        *,
+        platform: str,
+        display_name: str,
+        avatar_url: str | None,
+    ) -> None:
+        """Send *event* to every room in *targets* concurrently.
+
+        Sends are independent HTTP requests, so they run in parallel; a
+        failure in one room does not block the others.  Successful sends
+        are recorded in the event map with a single batched write.
+        """
+        reply_to = self._get_reply_to(event)
+        results = await asyncio.gather(
+            *(
+                self._send_as_puppet(
+                    platform=platform,
+                    sender=event.sender,
+                    display_name=display_name,
+                    avatar_url=avatar_url,
+                    room_id=target,
+                    content=event.content,
+                    reply_to_source=reply_to,
+                    target_room_id=target,
                 )
+                for target in targets
+            ),
+            return_exceptions=True,
+        )
+        stored = [
+            (target_evt, target)
+            for target_evt, target in zip(results, targets)
+            if isinstance(target_evt, str)
+        ]
+        if stored and self._event_map:
+            await self._event_map.store_many(event.event_id, event.room_id, stored)
 
     async def _send_as_puppet(
         self,
@@ -213,41 +294,59 @@ class RelayHandler:
 
             if is_media:
                 # Media: forward the content object, preserving mxc:// URL,
-                # info (dimensions, mimetype, size), etc.  Shallow-copy so
-                # that set_reply doesn't mutate the original (which is shared
-                # across multiple target rooms).
-                send_content = copy.copy(content) if mapped_reply_to else content
+                # info (dimensions, mimetype, size), etc.  The original is
+                # shared by every target room's concurrent send, so a reply
+                # gets a shallow copy with a relation object of its own;
+                # set_reply() would mutate the relates_to the copies share.
+                send_content = content
                 if mapped_reply_to:
-                    send_content.set_reply(mapped_reply_to)
+                    send_content = copy.copy(content)
+                    send_content.relates_to = RelatesTo(
+                        in_reply_to=InReplyTo(event_id=mapped_reply_to),
+                    )
                 event_id = await intent.send_message(room_id, send_content)
             elif mapped_reply_to:
-                # Text reply: build a TextMessageEventContent with m.in_reply_to.
-                from mautrix.types import (
-                    TextMessageEventContent,
-                    MessageType,
+                reply_content = self._build_reply_content(
+                    content.body or "", mapped_reply_to,
                 )
-                body = content.body or ""
-                reply_content = TextMessageEventContent(
-                    msgtype=MessageType.TEXT,
-                    body=body,
-                )
-                reply_content.set_reply(mapped_reply_to)
                 event_id = await intent.send_message(room_id, reply_content)
             else:
                 # Plain text message.
                 event_id = await intent.send_text(room_id, text=content.body or "")
 
-            body_preview = content.body or f"[{content.msgtype.value}]"
             log.info(
-                "Relayed to %s as %s (name=%r, avatar=%s): %s",
+                "Relayed to %s as %s (name=%r, avatar=%s): %.120s",
                 room_id, sender, display_name,
-                "yes" if avatar_url else "no", body_preview[:120],
+                "yes" if avatar_url else "no",
+                content.body or f"[{content.msgtype.value}]",
             )
             return event_id
         except Exception:
             log.exception("Failed to relay to %s", room_id)
             return None
 
+    @staticmethod
+    def _build_reply_content(body: str, reply_to: str) -> TextMessageEventContent:
+        """Build a text message that replies to *reply_to* via ``m.in_reply_to``."""
+        reply_content = TextMessageEventContent(msgtype=MessageType.TEXT, body=body)
+        reply_content.set_reply(reply_to)
+        return reply_content
+
+    def _is_duplicate(self, event_id: str) -> bool:
+        """Return True if *event_id* was already handled, recording it if not.
+
+        Only a redelivery of the same event counts: two sends of identical
+        text are distinct events with distinct IDs and are both relayed.
+        """
+        if event_id in self._seen_events:
+            self._seen_events.move_to_end(event_id)
+            log.debug("Skipping redelivered event %s", event_id)
+            return True
+        self._seen_events[event_id] = None
+        if len(self._seen_events) > self.DEDUPE_CACHE_SIZE:
+            self._seen_events.popitem(last=False)
+        return False
+
     @staticmethod
     def _is_media_content(content) -> bool:
         """Check whether a content object is a media type (image, video, file, audio)."""
@@ -275,7 +374,8 @@ class RelayHandler:
         bot_mxid: str = self._appservice.bot_mxid
 
         # Loop prevention: same layers apply.
-        if room_id in self._portal_rooms:
+        portal_platform = self._portal_platforms.get(room_id)
+        if portal_platform is not None:
             if should_ignore_in_portal(sender, "", bot_mxid):
                 return
         elif room_id == self._hub_room_id:
@@ -284,66 +384,90 @@ class RelayHandler:
         else:
             return
 
-        try:
-            reacted_to = event.content.relates_to.event_id
-            reaction_key = event.content.relates_to.key
-        except (AttributeError, TypeError):
+        relates_to = getattr(event.content, "relates_to", None)
+        reacted_to = getattr(relates_to, "event_id", None)
+        reaction_key = getattr(relates_to, "key", None)
+        if not reacted_to or not reaction_key:
             log.warning("Malformed reaction event from %s in %s", sender, room_id)
             return
+        # Reactions to messages we never relayed are common; bail out before
+        # the profile fetch and per-room lookups.
+        if not await self._event_map.has_event(reacted_to):
+            return
         display_name, avatar_url = await self._get_sender_profile(sender, room_id)
 
         # Determine platform and target rooms.
-        if room_id in self._portal_rooms:
-            source_label = self._portal_rooms[room_id]
-            platform = source_label.lower()
-            target_rooms = [self._hub_room_id] + [
-                p for p in self._portal_rooms if p != room_id
-            ]
+        if portal_platform is not None:
+            platform = portal_platform
+            target_rooms = (self._hub_room_id, *self._others[room_id])
         else:
             platform = platform_label(sender).lower()
-            target_rooms = list(self._portal_rooms)
+            target_rooms = self._all_portals
+
+        mapped = await self._event_map.lookup_many(reacted_to, target_rooms)
+        await asyncio.gather(
+            *(
+                self._relay_reaction(
+                    target_room,
+                    mapped_event,
+                    reaction_key,
+                    platform=platform,
+                    sender=sender,
+                    display_name=display_name,
+                    avatar_url=avatar_url,
+                )
+                for target_room, mapped_event in mapped.items()
+            ),
+            return_exceptions=True,
+        )
 
-        for target_room in target_rooms:
-            mapped_event = await self._event_map.lookup(reacted_to, target_room)
-            if not mapped_event:
-                continue
-            try:
-                # Portal rooms: use a double-puppeted user's intent so bridges
-                # accept the reaction (they ignore relay puppet reactions).
-                # Hub room: use puppet intent for correct identity display.
-                if target_room in self._portal_rooms and self._double_puppet_map:
-                    # Use the first double-puppeted user as the reaction proxy.
-                    # Currently assumes a single entry in the map — if multiple
-                    # users are added, consider a RELAY_REACTION_PROXY_USER env var.
-                    proxy_user = next(iter(self._double_puppet_map))
-                    intent = self._appservice.intent.user(proxy_user)
-                else:
-                    intent = await self._puppet_manager.get_intent(
-                        platform=platform,
-                        sender=sender,
-                        display_name=display_name,
-                        avatar_url=avatar_url,
-                        room_id=target_room,
-                        sync_member_state=(target_room == self._hub_room_id),
-                    )
-                await intent.react(target_room, mapped_event, reaction_key)
-                log.info(
-                    "Relayed reaction %s to %s in %s",
-                    reaction_key, mapped_event, target_room,
+    async def _relay_reaction(
+        self,
+        target_room: str,
+        mapped_event: str,
+        reaction_key: str,
+        *,
+        platform: str,
+        sender: str,
+        display_name: str,
+        avatar_url: str | None,
+    ) -> None:
+        """Send one reaction to *mapped_event* in *target_room*."""
+        try:
+            # Portal rooms: use a double-puppeted user's intent so bridges
+            # accept the reaction (they ignore relay puppet reactions).
+            # Hub room: use puppet intent for correct identity display.
+            if target_room in self._portal_rooms and self._double_puppet_map:
+                # Use the first double-puppeted user as the reaction proxy.
+                # Currently assumes a single entry in the map — if multiple
+                # users are added, consider a RELAY_REACTION_PROXY_USER env var.
+                proxy_user = next(iter(self._double_puppet_map))
+                intent = self._appservice.intent.user(proxy_user)
+            else:
+                intent = await self._puppet_manager.get_intent(
+                    platform=platform,
+                    sender=sender,
+                    display_name=display_name,
+                    avatar_url=avatar_url,
+                    room_id=target_room,
+                    sync_member_state=(target_room == self._hub_room_id),
                 )
-            except Exception:
-                log.exception("Failed to relay reaction to %s", target_room)
+            await intent.react(target_room, mapped_event, reaction_key)
+            log.info(
+                "Relayed reaction %s to %s in %s",
+                reaction_key, mapped_event, target_room,
+            )
+        except Exception:
+            log.exception("Failed to relay reaction to %s", target_room)
 
     @staticmethod
     def _get_reply_to(event) -> str | None:
         """Extract the replied-to event ID from the event, if any."""
-        try:
-            relates_to = event.content.relates_to
-            if relates_to and relates_to.in_reply_to:
-                return relates_to.in_reply_to.event_id
-        except (AttributeError, TypeError):
-            pass
-        return None
+        # getattr on None yields the default, so a missing link anywhere in
+        # the chain falls through to None without exception handling.
+        relates_to = getattr(event.content, "relates_to", None)
+        in_reply_to = getattr(relates_to, "in_reply_to", None)
+        return getattr(in_reply_to, "event_id", None) or None
 
     async def _resolve_double_puppet(
         self, sender: str, room_id: str,
@@ -358,12 +482,11 @@ class RelayHandler:
         of the portal room (e.g. ``signal_``, ``whatsapp_``) against the
         configured puppet MXIDs.
         """
-        portal_label = self._portal_rooms[room_id]  # e.g. "Signal", "WhatsApp"
-        prefix = portal_label.lower() + "_"  # e.g. "signal_", "whatsapp_"
+        prefix = self._portal_platforms[room_id] + "_"  # e.g. "signal_", "whatsapp_"
         puppet_mxids = self._double_puppet_map[sender]
 
         for puppet_mxid in puppet_mxids:
-            localpart = puppet_mxid.split(":")[0].lstrip("@")
+            localpart = puppet_mxid.partition(":")[0].lstrip("@")
             if not localpart.startswith(prefix):
                 continue
             try:
@@ -390,7 +513,8 @@ class RelayHandler:
 
         Results are cached for :attr:`PROFILE_CACHE_TTL` seconds so that
         repeated messages from the same sender don't each require a network
-        round-trip to the homeserver.
+        round-trip to the homeserver.  Concurrent misses for the same sender
+        share one fetch.
 
         Queries the profile via the appservice bot intent so we get the real
         display name that the mautrix bridge already set (e.g. "Alice") instead
@@ -406,15 +530,58 @@ class RelayHandler:
         if cached is not None:
             name, avatar, fetched_at = cached
             if now - fetched_at < self.PROFILE_CACHE_TTL:
+                self._profile_cache.move_to_end(cache_key)
                 return name, avatar
 
+        pending = self._profile_inflight.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_sender_profile(sender, room_id))
+            self._profile_inflight[cache_key] = pending
+            pending.add_done_callback(
+                lambda done: self._drop_inflight(cache_key, done),
+            )
+        # Shield so one cancelled caller doesn't cancel the shared fetch.
+        return await asyncio.shield(pending)
+
+    def _drop_inflight(
+        self,
+        cache_key: tuple[str, str | None],
+        done: asyncio.Future[tuple[str, str | None]],
+    ) -> None:
+        # handle_member() may already have replaced this fetch with a newer one.
+        if self._profile_inflight.get(cache_key) is done:
+            del self._profile_inflight[cache_key]
+
+    def _cache_profile(
+        self,
+        cache_key: tuple[str, str | None],
+        display_name: str,
+        avatar_url: str | None,
+        fetched_at: float,
+        generation: int,
+    ) -> None:
+        if generation != self._profile_generation:
+            return
+        self._profile_cache[cache_key] = (display_name, avatar_url, fetched_at)
+        self._profile_cache.move_to_end(cache_key)
+        if len(self._profile_cache) > self.PROFILE_CACHE_SIZE:
+            self._profile_cache.popitem(last=False)
+
+    async def _fetch_sender_profile(
+        self, sender: str, room_id: str | None,
+    ) -> tuple[str, str | None]:
+        """Resolve and cache the sender's profile (cache miss path)."""
+        now = time.monotonic()
+        cache_key = (sender, room_id)
+        generation = self._profile_generation
+
         # Check if this sender is a double-puppeted user in a portal room.
         # If so, look up the matching puppet's profile for the correct
         # platform-specific name and avatar.
         if room_id and room_id in self._portal_rooms and sender in self._double_puppet_map:
             puppet_profile = await self._resolve_double_puppet(sender, room_id)
             if puppet_profile:
-                self._profile_cache[cache_key] = (*puppet_profile, now)
+                self._cache_profile(cache_key, *puppet_profile, now, generation)
                 return puppet_profile
 
         if room_id:
@@ -429,7 +596,7 @@ class RelayHandler:
                     sender, room_id, display_name, avatar_url,
                 )
                 if display_name:
-                    self._profile_cache[cache_key] = (display_name, avatar_url, now)
+                    self._cache_profile(cache_key, display_name, avatar_url, now, generation)
                     return display_name, avatar_url
             except Exception:
                 log.debug("Member state lookup failed for %s in %s", sender, room_id)
@@ -443,12 +610,12 @@ class RelayHandler:
                 sender, display_name, avatar_url,
             )
             if display_name:
-                self._profile_cache[cache_key] = (display_name, avatar_url, now)
+                self._cache_profile(cache_key, display_name, avatar_url, now, generation)
                 return display_name, avatar_url
         except Exception:
             log.debug("Profile lookup failed for %s, using localpart", sender)
 
-        fallback = sender.split(":")[0].lstrip("@")
+        fallback = sender.partition(":")[0].lstrip("@")
         log.debug("Using MXID fallback for %s: %r", sender, fallback)
-        self._profile_cache[cache_key] = (fallback, None, now)
+        self._cache_profile(cache_key, fallback, None, now, generation)
         return fallback, None
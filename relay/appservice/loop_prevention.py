@@ -11,6 +11,7 @@ Three layers of filtering prevent message loops:
 
 from __future__ import annotations
 
+import functools
 import re
 
 # Bridge bot Matrix user localparts.
@@ -18,24 +19,62 @@ BRIDGE_BOT_LOCALPARTS = frozenset({
     "whatsappbot", "discordbot", "telegrambot", "signalbot",
 })
 
+# Bridge puppet localparts look like ``_<segment>_<id>``; map each bridge's
+# segment to its display label.
+_PLATFORM_BY_SEGMENT = {
+    "whatsapp": "WhatsApp",
+    "discord": "Discord",
+    "telegram": "Telegram",
+    "signal": "Signal",
+}
+
 # Bridge puppet MXID prefixes (created by mautrix bridges).
-BRIDGE_PUPPET_PREFIXES = (
-    "_whatsapp_", "_discord_", "_telegram_", "_signal_",
-)
+BRIDGE_PUPPET_PREFIXES = tuple(f"_{segment}_" for segment in _PLATFORM_BY_SEGMENT)
 
 # Relay puppet MXID prefix (created by this appservice).
 RELAY_PUPPET_PREFIX = "_relay_"
 
-# Matches both:
+# The puppet segment table folded into one pattern matched against the full
+# user ID, so platform_label() needs no split/strip.
+_PLATFORM_RE = re.compile(r"@?_(%s)_" % "|".join(_PLATFORM_BY_SEGMENT))
+
+# Attribution formats; has_attribution() picks one by the body's first
+# character instead of running an alternation:
 #   - Bold markdown: "**Name (Platform):** …"  (this bot's format)
 #   - Plain colon:   "Name: …"                 (Discord relay-mode webhook format)
+#
+# The bold form is checked with str.find (see _has_bold_attribution) rather
+# than r"\*\*.+\(.*\):\*\*": that pattern backtracks quadratically on bodies
+# like "**(a)(a)(a)…", stalling the event loop for seconds on ~100 KB input.
+_PLAIN_RE = re.compile(r"[A-Z][A-Za-z0-9_ ]+: ")
+
+# Both formats in one pattern, kept for callers of the public name;
+# has_attribution() does not use it.  The bold arm takes the earliest "("
+# after a non-empty name, as _has_bold_attribution does, so it runs in
+# linear time.
 ATTRIBUTION_RE = re.compile(
-    r"^\*\*.+\(.*\):\*\*"
+    r"^\*\*[^\n][^(\n]*\([^\n]*?\):\*\*"
     r"|"
     r"^[A-Z][A-Za-z0-9_ ]+: ",
 )
 
 
+def _localpart(user_id: str) -> str:
+    """Return the localpart of *user_id* (``@alice:domain`` -> ``alice``)."""
+    localpart = user_id.partition(":")[0]
+    return localpart[1:] if localpart.startswith("@") else localpart
+
+
+def _is_bridge_puppet_lp(localpart: str) -> bool:
+    """True if *localpart* is a bridge bot or a bridge puppet.
+
+    The single definition of a bridge entity, shared by
+    :func:`is_bridge_puppet` and :func:`should_ignore_in_hub`.  A bot
+    localpart must match whole; a puppet prefix only has to lead it.
+    """
+    return localpart in BRIDGE_BOT_LOCALPARTS or localpart.startswith(BRIDGE_PUPPET_PREFIXES)
+
+
 def is_own_message(sender: str, bot_mxid: str) -> bool:
     """Layer 1: True if the sender is the bot itself."""
     return sender == bot_mxid
@@ -43,14 +82,12 @@ def is_own_message(sender: str, bot_mxid: str) -> bool:
 
 def is_relay_puppet(user_id: str) -> bool:
     """Layer 1b: True if the user is one of our relay puppet users."""
-    localpart = user_id.split(":")[0].lstrip("@")
-    return localpart.startswith(RELAY_PUPPET_PREFIX)
+    return _localpart(user_id).startswith(RELAY_PUPPET_PREFIX)
 
 
 def is_bridge_bot(user_id: str) -> bool:
     """Layer 2: True if the user is a well-known bridge bot account."""
-    localpart = user_id.split(":")[0].lstrip("@")
-    return localpart in BRIDGE_BOT_LOCALPARTS
+    return _localpart(user_id) in BRIDGE_BOT_LOCALPARTS
 
 
 def is_bridge_puppet(user_id: str) -> bool:
@@ -59,33 +96,38 @@ def is_bridge_puppet(user_id: str) -> bool:
     Bridge puppets follow the pattern ``@_<bridgename>_<id>:domain``.
     Bridge bots are the well-known bot users.
     """
-    localpart = user_id.split(":")[0].lstrip("@")
-    if localpart in BRIDGE_BOT_LOCALPARTS:
-        return True
-    return localpart.startswith(BRIDGE_PUPPET_PREFIXES)
+    return _is_bridge_puppet_lp(_localpart(user_id))
+
+
+def _has_bold_attribution(body: str) -> bool:
+    """Return True if *body* (starting with ``**``) has a bold attribution."""
+    # "." stops at newlines, so the whole match lives on the first line.
+    line = body.partition("\n")[0]
+    # The earliest "(" after a non-empty name leaves the most room for "):**".
+    paren = line.find("(", 3)
+    return paren != -1 and line.find("):**", paren + 1) != -1
 
 
 def has_attribution(body: str) -> bool:
     """Layer 3: True if the message body already has relay attribution."""
-    return bool(ATTRIBUTION_RE.match(body))
+    # Most bodies start with neither "**" nor a capital letter, so they are
+    # rejected without touching the regex engine.
+    if body.startswith("**"):
+        return _has_bold_attribution(body)
+    if "A" <= body[:1] <= "Z":
+        return _PLAIN_RE.match(body) is not None
+    return False
 
 
+@functools.lru_cache(maxsize=4096)
 def platform_label(user_id: str) -> str:
     """Infer the originating platform from a Matrix user ID.
 
     Bridge puppet MXIDs contain a platform prefix (e.g. ``@_discord_123:domain``).
     For native Matrix users we return ``"Matrix"``.
     """
-    localpart = user_id.split(":")[0].lstrip("@")
-    for prefix, name in (
-        ("_discord_", "Discord"),
-        ("_telegram_", "Telegram"),
-        ("_signal_", "Signal"),
-        ("_whatsapp_", "WhatsApp"),
-    ):
-        if localpart.startswith(prefix):
-            return name
-    return "Matrix"
+    match = _PLATFORM_RE.match(user_id)
+    return _PLATFORM_BY_SEGMENT[match[1]] if match else "Matrix"
 
 
 def should_ignore_in_portal(sender: str, body: str, bot_mxid: str) -> bool:
@@ -94,15 +136,16 @@ def should_ignore_in_portal(sender: str, body: str, bot_mxid: str) -> bool:
     Portal rooms use lighter filtering: bridge puppets ARE the real users
     in megabridge portals and must be relayed.  Only bridge bots are filtered.
     """
-    if is_own_message(sender, bot_mxid):
-        return True
-    if is_relay_puppet(sender):
-        return True
-    if is_bridge_bot(sender):
-        return True
-    if has_attribution(body):
+    # The layer helpers above are inlined here: this runs for every event
+    # and the answer is almost always False, so avoid the extra frames.
+    if sender == bot_mxid:
         return True
-    return False
+    localpart = _localpart(sender)
+    return (
+        localpart.startswith(RELAY_PUPPET_PREFIX)
+        or localpart in BRIDGE_BOT_LOCALPARTS
+        or has_attribution(body)
+    )
 
 
 def should_ignore_in_hub(sender: str, body: str, bot_mxid: str) -> bool:
@@ -111,12 +154,13 @@ def should_ignore_in_hub(sender: str, body: str, bot_mxid: str) -> bool:
     The hub uses heavier filtering: both bridge bots and bridge puppet users
     are filtered because the bridges handle them natively.
     """
-    if is_own_message(sender, bot_mxid):
-        return True
-    if is_relay_puppet(sender):
-        return True
-    if is_bridge_puppet(sender):
+    # Inlined like should_ignore_in_portal(), except that the bridge-entity
+    # rule stays in one place.
+    if sender == bot_mxid:
         return True
-    if has_attribution(body):
-        return True
-    return False
+    localpart = _localpart(sender)
+    return (
+        localpart.startswith(RELAY_PUPPET_PREFIX)
+        or _is_bridge_puppet_lp(localpart)
+        or has_attribution(body)
+    )
@@ -7,13 +7,17 @@ account with text attribution.
 
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import logging
+from collections import OrderedDict
 from typing import TYPE_CHECKING
 
 from mautrix.types import EventType, MemberStateEventContent, Membership
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable
+
     from mautrix.appservice import AppService
     from mautrix.appservice.api import IntentAPI
 
@@ -28,11 +32,21 @@ class PuppetManager:
     repeated messages from the same sender reuse the same puppet.
     """
 
+    #: Maximum number of ``(platform, sender)`` -> MXID results kept in memory.
+    MXID_CACHE_SIZE: int = 4096
+
+    #: Maximum number of puppets whose intent and profile are kept in memory.
+    PUPPET_CACHE_SIZE: int = 4096
+
+    #: Maximum number of ``(puppet, room)`` member profiles kept in memory.
+    MEMBER_CACHE_SIZE: int = 16384
+
     def __init__(self, appservice: AppService, domain: str) -> None:
         self._appservice = appservice
         self._domain = domain
-        # Cache: puppet_mxid -> IntentAPI
-        self._intents: dict[str, IntentAPI] = {}
+        # Cache: puppet_mxid -> IntentAPI (LRU; evicting a puppet also drops
+        # its display name and avatar entries)
+        self._intents: OrderedDict[str, IntentAPI] = OrderedDict()
         # Cache: puppet_mxid -> last display name set
         self._display_names: dict[str, str] = {}
         # Cache: puppet_mxid -> last avatar URL set
@@ -40,8 +54,16 @@ class PuppetManager:
         # Cache: (puppet_mxid, room_id) -> (display_name, avatar_url) last
         # written into the room member state event.  Bridges read the room
         # member event (not the global profile) to get display names and
-        # avatars, so we must explicitly keep it in sync.
-        self._member_profiles: dict[tuple[str, str], tuple[str, str | None]] = {}
+        # avatars, so we must explicitly keep it in sync.  LRU-bounded: an
+        # evicted entry just costs one more join-with-profile state event.
+        self._member_profiles: OrderedDict[
+            tuple[str, str], tuple[str, str | None]
+        ] = OrderedDict()
+        # Cache: (platform, sender) -> puppet MXID (FIFO-bounded)
+        self._mxid_cache: dict[tuple[str, str], str] = {}
+        # Registrations / global profile updates currently in flight, so
+        # concurrent fan-out sends for one puppet share a single update.
+        self._profile_inflight: dict[str, asyncio.Future[IntentAPI]] = {}
 
     def mxid_for(self, platform: str, sender: str) -> str:
         """Return a deterministic puppet MXID for *sender* on *platform*.
@@ -49,9 +71,21 @@ class PuppetManager:
         The MXID is ``@_relay_{platform}_{hash8}:{domain}`` where *hash8* is
         the first 8 hex characters of the SHA-256 hash of ``{platform}:{sender}``.
         """
+        key = (platform, sender)
+        try:
+            return self._mxid_cache[key]
+        except KeyError:
+            pass
         raw = f"{platform}:{sender}"
-        hash8 = hashlib.sha256(raw.encode()).hexdigest()[:8]
-        return f"@_relay_{platform}_{hash8}:{self._domain}"
+        # Hex-encode only the 4 bytes we keep.  The hash function must not
+        # change: existing puppets are registered under these MXIDs.
+        hash8 = hashlib.sha256(raw.encode()).digest()[:4].hex()
+        mxid = f"@_relay_{platform}_{hash8}:{self._domain}"
+        if len(self._mxid_cache) >= self.MXID_CACHE_SIZE:
+            # Dicts keep insertion order, so the first key is the oldest.
+            del self._mxid_cache[next(iter(self._mxid_cache))]
+        self._mxid_cache[key] = mxid
+        return mxid
 
     async def get_intent(
         self,
@@ -70,6 +104,9 @@ class PuppetManager:
         - Sets its display name (just the name, no platform suffix).
         - Sets its avatar URL if provided.
 
+        Concurrent calls for one puppet (e.g. a fan-out to several rooms)
+        share a single registration and global profile update.
+
         Room join strategy (avoids breaking bridge-managed portal rooms):
 
         - **First entry** to any room: a single ``m.room.member`` state event
@@ -95,24 +132,7 @@ class PuppetManager:
                 (hub room); portal rooms should pass False.
         """
         mxid = self.mxid_for(platform, sender)
-
-        if mxid not in self._intents:
-            intent = self._appservice.intent.user(mxid)
-            await intent.ensure_registered()
-            await intent.set_displayname(display_name)
-            self._intents[mxid] = intent
-            self._display_names[mxid] = display_name
-            if avatar_url:
-                await intent.set_avatar_url(avatar_url)
-            self._avatar_urls[mxid] = avatar_url
-        else:
-            intent = self._intents[mxid]
-            if self._display_names.get(mxid) != display_name:
-                await intent.set_displayname(display_name)
-                self._display_names[mxid] = display_name
-            if self._avatar_urls.get(mxid) != avatar_url:
-                await intent.set_avatar_url(avatar_url)
-                self._avatar_urls[mxid] = avatar_url
+        intent = await self._ensure_profile(mxid, display_name, avatar_url)
 
         # Bridges read display names and avatars from the m.room.member
         # state event, NOT the global profile.  Continuwuity doesn't
@@ -127,21 +147,92 @@ class PuppetManager:
         member_key = (mxid, room_id)
         cached = self._member_profiles.get(member_key)
 
-        if cached is None:
-            # First entry: single state event = join + profile.
-            await self._send_member_event(intent, mxid, room_id, display_name, avatar_url)
-            self._member_profiles[member_key] = current_profile
-        elif cached != current_profile and sync_member_state:
-            # Profile changed in a room we control — re-sync state.
+        if cached is None or (cached != current_profile and sync_member_state):
+            # First entry: single state event = join + profile.  Or the
+            # profile changed in a room we control — re-sync state.
             await self._send_member_event(intent, mxid, room_id, display_name, avatar_url)
             self._member_profiles[member_key] = current_profile
+            self._member_profiles.move_to_end(member_key)
+            if len(self._member_profiles) > self.MEMBER_CACHE_SIZE:
+                self._member_profiles.popitem(last=False)
         else:
             # Already joined with current profile (or portal with stale
             # profile).  Just ensure membership as a safety net.
+            self._member_profiles.move_to_end(member_key)
             await intent.ensure_joined(room_id)
 
         return intent
 
+    async def _ensure_profile(
+        self, mxid: str, display_name: str, avatar_url: str | None,
+    ) -> IntentAPI:
+        """Return the puppet's intent once it is registered with this profile.
+
+        A fan-out calls :meth:`get_intent` for every target room at once, so
+        concurrent callers for the same puppet share one in-flight update
+        rather than each registering it and re-sending its global profile.
+        """
+        while True:
+            intent = self._intents.get(mxid)
+            if (
+                intent is not None
+                and self._display_names.get(mxid) == display_name
+                and self._avatar_urls.get(mxid) == avatar_url
+            ):
+                self._intents.move_to_end(mxid)
+                return intent
+            pending = self._profile_inflight.get(mxid)
+            if pending is None:
+                break
+            # Another caller is registering or updating this puppet.  Wait
+            # for it (success or not) and re-check: it may have set the same
+            # profile, or failed and left the work to us.
+            await asyncio.wait((pending,))
+
+        pending = asyncio.ensure_future(
+            self._update_profile(mxid, intent, display_name, avatar_url),
+        )
+        self._profile_inflight[mxid] = pending
+        pending.add_done_callback(lambda _: self._profile_inflight.pop(mxid, None))
+        # Shield so one cancelled caller doesn't cancel the shared update.
+        return await asyncio.shield(pending)
+
+    async def _update_profile(
+        self,
+        mxid: str,
+        intent: IntentAPI | None,
+        display_name: str,
+        avatar_url: str | None,
+    ) -> IntentAPI:
+        """Register the puppet if needed and bring its global profile up to date.
+
+        The caches are only written once every request has succeeded, so a
+        failure is retried by the next call.
+        """
+        requests: list[Awaitable[object]] = []
+        if intent is None:
+            intent = self._appservice.intent.user(mxid)
+            await intent.ensure_registered()
+            requests.append(intent.set_displayname(display_name))
+            if avatar_url:
+                requests.append(intent.set_avatar_url(avatar_url))
+        else:
+            if self._display_names.get(mxid) != display_name:
+                requests.append(intent.set_displayname(display_name))
+            if self._avatar_urls.get(mxid) != avatar_url:
+                requests.append(intent.set_avatar_url(avatar_url))
+        await asyncio.gather(*requests)
+
+        self._intents[mxid] = intent
+        self._intents.move_to_end(mxid)
+        self._display_names[mxid] = display_name
+        self._avatar_urls[mxid] = avatar_url
+        if len(self._intents) > self.PUPPET_CACHE_SIZE:
+            evicted, _ = self._intents.popitem(last=False)
+            self._display_names.pop(evicted, None)
+            self._avatar_urls.pop(evicted, None)
+        return intent
+
     @staticmethod
     async def _send_member_event(
         intent: IntentAPI,
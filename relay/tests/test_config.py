@@ -6,9 +6,6 @@ applies defaults, trims whitespace, and exits on missing required values.
 
 from __future__ import annotations
 
-import os
-from unittest.mock import patch
-
 import pytest
 
 from appservice.config import RelayConfig
@@ -26,9 +23,7 @@ REQUIRED_ENV = {
 
 def _make_config(**overrides: str) -> RelayConfig:
     """Build a :class:`RelayConfig` with *overrides* applied on top of defaults."""
-    env = {**REQUIRED_ENV, **overrides}
-    with patch.dict(os.environ, env, clear=False):
-        return RelayConfig.from_env()
+    return RelayConfig.from_env({**REQUIRED_ENV, **overrides})
 
 
 # ---------------------------------------------------------------------------
@@ -58,6 +53,11 @@ class TestRelayConfigFromEnv:
         config = _make_config(RELAY_PORTAL_ROOMS="!wa:example.com=WhatsApp")
         assert config.portal_rooms == {"!wa:example.com": "WhatsApp"}
 
+    def test_portal_rooms_read_only(self):
+        config = _make_config()
+        with pytest.raises(TypeError):
+            config.portal_rooms["!new:example.com"] = "Telegram"  # type: ignore[index]
+
     def test_default_bot_localpart(self):
         config = _make_config()
         assert config.bot_localpart == "relay-bot"
@@ -119,13 +119,13 @@ class TestRelayConfigMissingRequired:
     ])
     def test_missing_required_exits(self, missing_var: str):
         env = {**REQUIRED_ENV, missing_var: ""}
-        with patch.dict(os.environ, env, clear=False), pytest.raises(SystemExit):
-            RelayConfig.from_env()
+        with pytest.raises(SystemExit):
+            RelayConfig.from_env(env)
 
     def test_missing_portal_label_exits(self):
         env = {**REQUIRED_ENV, "RELAY_PORTAL_ROOMS": "!wa:example.com"}
-        with patch.dict(os.environ, env, clear=False), pytest.raises(SystemExit):
-            RelayConfig.from_env()
+        with pytest.raises(SystemExit):
+            RelayConfig.from_env(env)
 
 
 # ---------------------------------------------------------------------------
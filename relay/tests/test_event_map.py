@@ -8,6 +8,8 @@ All tests use in-memory SQLite (``:memory:``) for speed.
 
 from __future__ import annotations
 
+import asyncio
+import sqlite3
 import time
 
 import pytest
@@ -87,6 +89,291 @@ class TestStoreAndLookup:
         assert await event_map.lookup("$tgt1", "!wa:ex.com") == "$tgt_wa"
 
 
+# ---------------------------------------------------------------------------
+# has_event
+# ---------------------------------------------------------------------------
+
+
+class TestHasEvent:
+
+    async def test_source_and_target_are_known(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+
+        assert await event_map.has_event("$src1") is True
+        assert await event_map.has_event("$tgt1") is True
+
+    async def test_unknown_event(self, event_map: EventMap):
+        assert await event_map.has_event("$nonexistent") is False
+
+
+# ---------------------------------------------------------------------------
+# lookup_many
+# ---------------------------------------------------------------------------
+
+
+class TestLookupMany:
+
+    async def test_returns_only_mapped_rooms(self, event_map: EventMap):
+        await event_map.store_many(
+            "$src1", "!portal:ex.com", [("$tgt_hub", "!hub:ex.com"), ("$tgt_wa", "!wa:ex.com")],
+        )
+
+        result = await event_map.lookup_many(
+            "$src1", ["!hub:ex.com", "!wa:ex.com", "!other:ex.com"],
+        )
+
+        assert result == {"!hub:ex.com": "$tgt_hub", "!wa:ex.com": "$tgt_wa"}
+
+    async def test_unknown_event_returns_empty(self, event_map: EventMap):
+        assert await event_map.lookup_many("$nonexistent", ["!hub:ex.com"]) == {}
+
+    async def test_populates_lookup_cache(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+
+        await event_map.lookup_many("$src1", ["!hub:ex.com", "!wa:ex.com"])
+
+        assert event_map._lookup_cache[("$src1", "!hub:ex.com")] == "$tgt1"
+        assert event_map._lookup_cache[("$src1", "!wa:ex.com")] is None
+
+
+# ---------------------------------------------------------------------------
+# lookup cache
+# ---------------------------------------------------------------------------
+
+
+class TestLookupCache:
+
+    async def test_repeat_lookup_served_from_cache(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt1"
+
+        # Remove the row behind the cache's back: the cached value survives.
+        await event_map._db.execute("DELETE FROM event_group_events")
+        await event_map._db.commit()
+
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt1"
+
+    async def test_cached_miss_invalidated_by_store(self, event_map: EventMap):
+        assert await event_map.lookup("$src1", "!hub:ex.com") is None
+
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt1"
+
+    async def test_cached_miss_invalidated_by_group_join(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        assert await event_map.lookup("$src1", "!wa:ex.com") is None
+
+        await event_map.store("$tgt1", "!hub:ex.com", "$tgt_wa", "!wa:ex.com")
+
+        assert await event_map.lookup("$src1", "!wa:ex.com") == "$tgt_wa"
+
+    async def test_read_overtaken_by_store_is_not_cached(self, event_map: EventMap):
+        """A miss read before a store commits must not outlive the store."""
+        read_done = asyncio.Event()
+        release = asyncio.Event()
+        lookup_db = event_map._lookup_db
+
+        async def _slow_lookup_db(*args):
+            result = await lookup_db(*args)
+            read_done.set()
+            await release.wait()
+            return result
+
+        event_map._lookup_db = _slow_lookup_db
+        pending = asyncio.create_task(event_map.lookup("$src1", "!hub:ex.com"))
+        await read_done.wait()
+
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        release.set()
+
+        # The in-flight read still answers with what it saw...
+        assert await pending is None
+        # ...but its stale miss is not served to later lookups.
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt1"
+
+    async def test_cache_is_bounded(self, event_map: EventMap):
+        event_map.LOOKUP_CACHE_SIZE = 2
+
+        for i in range(5):
+            await event_map.lookup(f"$src{i}", "!hub:ex.com")
+
+        assert len(event_map._lookup_cache) == 2
+
+
+# ---------------------------------------------------------------------------
+# store_many
+# ---------------------------------------------------------------------------
+
+
+class TestStoreMany:
+
+    async def test_store_many_maps_all_targets(self, event_map: EventMap):
+        await event_map.store_many(
+            "$src1",
+            "!portal:ex.com",
+            [("$tgt_hub", "!hub:ex.com"), ("$tgt_wa", "!wa:ex.com")],
+        )
+
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt_hub"
+        assert await event_map.lookup("$src1", "!wa:ex.com") == "$tgt_wa"
+        # Targets are grouped together, so lookups work from any member.
+        assert await event_map.lookup("$tgt_wa", "!hub:ex.com") == "$tgt_hub"
+
+    async def test_store_many_empty_is_noop(self, event_map: EventMap):
+        await event_map.store_many("$src1", "!portal:ex.com", [])
+
+        assert await event_map.lookup("$src1", "!portal:ex.com") is None
+
+    async def test_store_many_joins_existing_group(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt_hub", "!hub:ex.com")
+
+        await event_map.store_many("$tgt_hub", "!hub:ex.com", [("$tgt_wa", "!wa:ex.com")])
+
+        assert await event_map.lookup("$src1", "!wa:ex.com") == "$tgt_wa"
+
+
+# ---------------------------------------------------------------------------
+# group commit
+# ---------------------------------------------------------------------------
+
+
+class TestGroupCommit:
+
+    async def test_concurrent_stores_share_a_commit(self, event_map: EventMap):
+        batches: list[int] = []
+        commit_batch = event_map._commit_batch
+
+        async def _spy(batch):
+            batches.append(len(batch))
+            await commit_batch(batch)
+
+        event_map._commit_batch = _spy
+
+        await asyncio.gather(
+            *(
+                event_map.store(f"$src{i}", "!portal:ex.com", f"$tgt{i}", "!hub:ex.com")
+                for i in range(5)
+            ),
+        )
+
+        assert sum(batches) == 5
+        assert len(batches) < 5
+        for i in range(5):
+            assert await event_map.lookup(f"$src{i}", "!hub:ex.com") == f"$tgt{i}"
+
+    async def test_failed_store_does_not_sink_batch(self, event_map: EventMap):
+        results = await asyncio.gather(
+            event_map.store("$ok1", "!portal:ex.com", "$tgt1", "!hub:ex.com"),
+            event_map.store("$bad", None, "$tgt_bad", "!hub:ex.com"),  # NOT NULL
+            event_map.store("$ok2", "!portal:ex.com", "$tgt2", "!hub:ex.com"),
+            return_exceptions=True,
+        )
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], Exception)
+        assert await event_map.lookup("$ok1", "!hub:ex.com") == "$tgt1"
+        assert await event_map.lookup("$ok2", "!hub:ex.com") == "$tgt2"
+        assert await event_map.lookup("$bad", "!hub:ex.com") is None
+
+    async def test_close_flushes_pending_stores(self, tmp_path):
+        db_path = str(tmp_path / "relay.db")
+        em = EventMap(db_path)
+        await em.open()
+        pending = asyncio.ensure_future(
+            em.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com"),
+        )
+        await asyncio.sleep(0)
+        await em.close()
+        await pending
+
+        reopened = EventMap(db_path)
+        await reopened.open()
+        try:
+            assert await reopened.lookup("$src1", "!hub:ex.com") == "$tgt1"
+        finally:
+            await reopened.close()
+
+    async def test_store_during_close_is_rejected(self, event_map: EventMap):
+        """A store queued behind the close sentinel fails instead of hanging."""
+        closing = asyncio.ensure_future(event_map.close())
+        await asyncio.sleep(0)
+
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(
+                event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com"),
+                timeout=1,
+            )
+        await closing
+
+    async def test_failed_rollback_settles_waiters(self, event_map: EventMap):
+        """A writer that cannot roll back fails its stores and stops cleanly."""
+        async def _fail():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        event_map._db.commit = _fail
+        event_map._db.rollback = _fail
+
+        with pytest.raises(sqlite3.OperationalError):
+            await asyncio.wait_for(
+                event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com"),
+                timeout=1,
+            )
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(
+                event_map.store("$src2", "!portal:ex.com", "$tgt2", "!hub:ex.com"),
+                timeout=1,
+            )
+
+
+# ---------------------------------------------------------------------------
+# grouping
+# ---------------------------------------------------------------------------
+
+
+class TestGrouping:
+
+    async def _group_count(self, event_map: EventMap) -> int:
+        cursor = await event_map._db.execute("SELECT COUNT(*) FROM event_groups")
+        return (await cursor.fetchone())[0]
+
+    async def test_new_group_id_derived_from_members(self, event_map: EventMap):
+        await event_map.store("$b_src", "!portal:ex.com", "$a_tgt", "!hub:ex.com")
+
+        cursor = await event_map._db.execute("SELECT group_id FROM event_groups")
+        assert await cursor.fetchall() == [("$a_tgt",)]
+
+    async def test_joining_existing_group_leaves_no_orphans(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        # "$a_wa" sorts first, so its derived ID differs from the existing group.
+        await event_map.store("$tgt1", "!hub:ex.com", "$a_wa", "!wa:ex.com")
+
+        assert await event_map.lookup("$src1", "!wa:ex.com") == "$a_wa"
+        assert await self._group_count(event_map) == 1
+
+    async def test_bridging_two_groups_merges_them(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        await event_map.store("$src2", "!sig:ex.com", "$tgt2", "!wa:ex.com")
+
+        await event_map.store("$tgt1", "!hub:ex.com", "$tgt2", "!wa:ex.com")
+
+        assert await event_map.lookup("$src1", "!sig:ex.com") == "$src2"
+        assert await event_map.lookup("$src2", "!portal:ex.com") == "$src1"
+        assert await self._group_count(event_map) == 1
+
+    async def test_store_many_merges_several_groups(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+        await event_map.store("$src2", "!sig:ex.com", "$tgt2", "!wa:ex.com")
+        await event_map.store("$src3", "!tg:ex.com", "$tgt3", "!dc:ex.com")
+
+        await event_map.store_many(
+            "$tgt1", "!hub:ex.com", [("$tgt2", "!wa:ex.com"), ("$tgt3", "!dc:ex.com")],
+        )
+
+        assert await event_map.lookup("$src1", "!sig:ex.com") == "$src2"
+        assert await event_map.lookup("$src1", "!tg:ex.com") == "$src3"
+        assert await self._group_count(event_map) == 1
+
 # ---------------------------------------------------------------------------
 # cleanup
 # ---------------------------------------------------------------------------
@@ -110,6 +397,64 @@ class TestCleanup:
         assert removed >= 1
         assert await event_map.lookup("$old", "!h:ex.com") is None
 
+    async def test_cleanup_cascades_to_all_events(self, event_map: EventMap):
+        await event_map.store_many(
+            "$old", "!p:ex.com", [("$old_h", "!h:ex.com"), ("$old_w", "!w:ex.com")],
+        )
+        old_ts = time.time() - (31 * 86400)
+        await event_map._db.execute(
+            "UPDATE event_group_events SET created_at = ?", (old_ts,),
+        )
+        await event_map._db.commit()
+
+        removed = await event_map.cleanup(max_age_days=30)
+
+        assert removed == 3
+        cursor = await event_map._db.execute("SELECT COUNT(*) FROM event_groups")
+        assert (await cursor.fetchone())[0] == 0
+
+    async def test_cleanup_keeps_group_with_recent_event(self, event_map: EventMap):
+        await event_map.store("$old", "!p:ex.com", "$old_t", "!h:ex.com")
+        old_ts = time.time() - (31 * 86400)
+        await event_map._db.execute(
+            "UPDATE event_group_events SET created_at = ?", (old_ts,),
+        )
+        await event_map._db.commit()
+        # A later store joins the same group with a fresh timestamp.
+        await event_map.store("$old_t", "!h:ex.com", "$new_w", "!w:ex.com")
+
+        removed = await event_map.cleanup(max_age_days=30)
+
+        assert removed == 0
+        assert await event_map.lookup("$old", "!w:ex.com") == "$new_w"
+
+    async def test_cleanup_on_maintenance_connection(self, tmp_path):
+        em = EventMap(str(tmp_path / "relay.db"))
+        await em.open()
+        try:
+            await em.store("$old", "!p:ex.com", "$old_t", "!h:ex.com")
+            await em.store("$new", "!p:ex.com", "$new_t", "!h:ex.com")
+            old_ts = time.time() - (31 * 86400)
+            await em._db.execute(
+                "UPDATE event_group_events SET created_at = ? WHERE event_id IN (?, ?)",
+                (old_ts, "$old", "$old_t"),
+            )
+            await em._db.commit()
+
+            maint = await em.connect_maintenance()
+            try:
+                removed = await em.cleanup(max_age_days=30, conn=maint)
+                await em.optimize(conn=maint)
+                await em.checkpoint(conn=maint)
+            finally:
+                await maint.close()
+
+            assert removed == 2
+            assert await em.lookup("$old", "!h:ex.com") is None
+            assert await em.lookup("$new", "!h:ex.com") == "$new_t"
+        finally:
+            await em.close()
+
     async def test_cleanup_keeps_recent_entries(self, event_map: EventMap):
         await event_map.store("$new", "!p:ex.com", "$new_t", "!h:ex.com")
 
@@ -117,3 +462,74 @@ class TestCleanup:
 
         assert removed == 0
         assert await event_map.lookup("$new", "!h:ex.com") == "$new_t"
+
+
+# ---------------------------------------------------------------------------
+# Connection tuning
+# ---------------------------------------------------------------------------
+
+
+class TestPragmas:
+
+    async def test_synchronous_normal(self, event_map: EventMap):
+        cursor = await event_map._db.execute("PRAGMA synchronous")
+        assert (await cursor.fetchone())[0] == 1  # NORMAL
+
+    async def test_busy_timeout_set(self, event_map: EventMap):
+        cursor = await event_map._db.execute("PRAGMA busy_timeout")
+        assert (await cursor.fetchone())[0] == 30000
+
+    async def test_file_database_is_memory_mapped(self, tmp_path):
+        em = EventMap(str(tmp_path / "relay.db"))
+        await em.open()
+        try:
+            cursor = await em._db.execute("PRAGMA mmap_size")
+            assert (await cursor.fetchone())[0] == EventMap.MMAP_SIZE
+        finally:
+            await em.close()
+
+    async def test_optimize_runs(self, event_map: EventMap):
+        await event_map.store("$src1", "!portal:ex.com", "$tgt1", "!hub:ex.com")
+
+        await event_map.optimize()
+
+        assert await event_map.lookup("$src1", "!hub:ex.com") == "$tgt1"
+
+
+# ---------------------------------------------------------------------------
+# Schema upgrades
+# ---------------------------------------------------------------------------
+
+
+class TestSchemaUpgrade:
+
+    async def test_rowid_events_table_rebuilt(self, tmp_path):
+        """A database from before WITHOUT ROWID keeps its mappings."""
+        path = str(tmp_path / "relay.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "CREATE TABLE event_groups ("
+            " group_id TEXT PRIMARY KEY, created_at REAL NOT NULL);"
+            "CREATE TABLE event_group_events ("
+            " group_id TEXT NOT NULL, room_id TEXT NOT NULL,"
+            " event_id TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (group_id, room_id), UNIQUE (event_id),"
+            " FOREIGN KEY (group_id) REFERENCES event_groups(group_id)"
+            " ON DELETE CASCADE);"
+            "INSERT INTO event_groups VALUES ('$a', 1.0);"
+            "INSERT INTO event_group_events VALUES ('$a', '!p:ex.com', '$a', 1.0);"
+            "INSERT INTO event_group_events VALUES ('$a', '!h:ex.com', '$b', 1.0);",
+        )
+        conn.close()
+
+        em = EventMap(path)
+        await em.open()
+        try:
+            cursor = await em._db.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'event_group_events'",
+            )
+            assert "WITHOUT ROWID" in (await cursor.fetchone())[0]
+            assert await em.lookup("$a", "!h:ex.com") == "$b"
+            assert await em.lookup("$b", "!p:ex.com") == "$a"
+        finally:
+            await em.close()
@@ -12,9 +12,16 @@ Key differences from old tests:
 
 from __future__ import annotations
 
-from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+from collections import ChainMap
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from mautrix.types import MediaMessageEventContent, MessageType
 
 from appservice.config import RelayConfig
 from appservice.handler import RelayHandler
@@ -29,10 +36,11 @@ WHATSAPP_ROOM = "!whatsapp:example.com"
 SIGNAL_ROOM = "!signal:example.com"
 HUB_ROOM = "!hub:example.com"
 
-PORTAL_ROOMS = {
+# Read-only, like RelayConfig.portal_rooms, so no test can leak a mutation.
+PORTAL_ROOMS = MappingProxyType({
     WHATSAPP_ROOM: "WhatsApp",
     SIGNAL_ROOM: "Signal",
-}
+})
 
 
 # ---------------------------------------------------------------------------
@@ -40,24 +48,53 @@ PORTAL_ROOMS = {
 # ---------------------------------------------------------------------------
 
 
+@dataclass(slots=True)
+class FakeMsgtype:
+    value: str
+
+
+@dataclass(slots=True)
+class FakeContent:
+    """Just the text-message content fields the handler reads."""
+
+    msgtype: FakeMsgtype
+    body: str | None
+    relates_to: Any = None
+
+
+@dataclass(slots=True)
+class FakeEvent:
+    sender: str
+    room_id: str
+    event_id: str
+    content: FakeContent | None
+
+
+@dataclass(frozen=True, slots=True)
+class FakeProfile:
+    """Stand-in for the profile ``get_profile()`` returns."""
+
+    displayname: str
+    avatar_url: str | None = None
+
+
 def _make_message_event(
     sender: str,
     room_id: str,
     body: str,
     event_id: str = "$evt1",
-) -> MagicMock:
-    """Build a mock mautrix MessageEvent."""
-    event = MagicMock()
-    event.sender = sender
-    event.room_id = room_id
-    event.event_id = event_id
-
-    # content
-    event.content.msgtype.value = "m.text"
-    event.content.body = body
-    event.content.relates_to = None
+) -> FakeEvent:
+    """Build a stand-in for a mautrix text MessageEvent.
 
-    return event
+    Plain slotted dataclasses rather than ``MagicMock``: unknown attributes
+    raise instead of silently returning a child mock.
+    """
+    return FakeEvent(
+        sender=sender,
+        room_id=room_id,
+        event_id=event_id,
+        content=FakeContent(msgtype=FakeMsgtype("m.text"), body=body),
+    )
 
 
 def _make_media_event(
@@ -92,17 +129,14 @@ def _make_media_event(
     return event
 
 
-def _make_profile(displayname: str, avatar_url: str | None = None) -> MagicMock:
-    """Build a mock profile response."""
-    profile = MagicMock()
-    profile.displayname = displayname
-    profile.avatar_url = avatar_url
-    return profile
+def _make_profile(displayname: str, avatar_url: str | None = None) -> FakeProfile:
+    """Build a profile response."""
+    return FakeProfile(displayname, avatar_url)
 
 
 # Default profiles keyed by sender MXID.  Tests can override via
 # ``appservice.intent.get_profile.side_effect``.
-_DEFAULT_PROFILES: dict[str, MagicMock] = {
+_DEFAULT_PROFILES: dict[str, FakeProfile] = {
     "@_whatsapp_12345:example.com": _make_profile("Alice"),
     "@_signal_abc:example.com": _make_profile("Bob"),
     "@nick:example.com": _make_profile("Nick"),
@@ -110,9 +144,9 @@ _DEFAULT_PROFILES: dict[str, MagicMock] = {
 
 
 def _make_handler(
-    portal_rooms: dict[str, str] | None = None,
+    portal_rooms: Mapping[str, str] | None = None,
     hub_room: str = HUB_ROOM,
-    profiles: dict[str, MagicMock] | None = None,
+    profiles: dict[str, FakeProfile] | None = None,
 ) -> tuple[RelayHandler, AsyncMock]:
     """Build a RelayHandler with a mocked puppet manager.
 
@@ -123,7 +157,7 @@ def _make_handler(
     from *profiles* (defaults to ``_DEFAULT_PROFILES``).  Unknown senders
     raise an ``Exception`` so the handler falls back to the MXID localpart.
     """
-    merged_profiles = {**_DEFAULT_PROFILES, **(profiles or {})}
+    merged_profiles = ChainMap(profiles or {}, _DEFAULT_PROFILES)
 
     appservice = MagicMock()
     appservice.bot_mxid = BOT_MXID
@@ -153,6 +187,14 @@ def _make_handler(
     return handler, puppet_intent
 
 
+def _target_rooms(send: AsyncMock) -> set[str]:
+    """Return the room IDs *send* (``send_text``/``send_message``) was awaited with."""
+    return {
+        call.args[0] if call.args else call.kwargs.get("room_id")
+        for call in send.await_args_list
+    }
+
+
 # ---------------------------------------------------------------------------
 # Fixtures
 # ---------------------------------------------------------------------------
@@ -200,12 +242,7 @@ class TestPortalToHub:
             sync_member_state=True,
         )
         # Message was sent to hub room.
-        hub_calls = [
-            c for c in puppet_intent.send_text.await_args_list
-            if c.kwargs.get("room_id") == HUB_ROOM
-            or (c.args and c.args[0] == HUB_ROOM)
-        ]
-        assert len(hub_calls) >= 1
+        assert HUB_ROOM in _target_rooms(puppet_intent.send_text)
 
     async def test_signal_message_relayed_to_hub(self, handler, puppet_intent):
         event = _make_message_event(
@@ -216,12 +253,7 @@ class TestPortalToHub:
 
         await handler.handle_message(event)
 
-        hub_calls = [
-            c for c in puppet_intent.send_text.await_args_list
-            if c.kwargs.get("room_id") == HUB_ROOM
-            or (c.args and c.args[0] == HUB_ROOM)
-        ]
-        assert len(hub_calls) >= 1
+        assert HUB_ROOM in _target_rooms(puppet_intent.send_text)
 
 
 # ---------------------------------------------------------------------------
@@ -241,13 +273,23 @@ class TestHubToPortals:
 
         await handler.handle_message(event)
 
-        target_rooms = set()
-        for call in puppet_intent.send_text.await_args_list:
-            room = call.args[0] if call.args else call.kwargs.get("room_id")
-            target_rooms.add(room)
+        target_rooms = _target_rooms(puppet_intent.send_text)
         assert WHATSAPP_ROOM in target_rooms
         assert SIGNAL_ROOM in target_rooms
 
+    async def test_hub_fanout_resolves_profile_once(self, handler, puppet_intent):
+        """The sender's profile is fetched once, not once per portal."""
+        event = _make_message_event(
+            sender="@nick:example.com",
+            room_id=HUB_ROOM,
+            body="hey everyone",
+        )
+
+        await handler.handle_message(event)
+
+        assert puppet_intent.send_text.await_count == len(PORTAL_ROOMS)
+        assert handler._appservice.intent.get_profile.await_count == 1
+
     async def test_hub_fanout_uses_puppet_display_name(self, handler, puppet_intent):
         """Puppet display name is just the name — no platform suffix."""
         event = _make_message_event(
@@ -280,10 +322,7 @@ class TestPortalToPortal:
 
         await handler.handle_message(event)
 
-        target_rooms = set()
-        for call in puppet_intent.send_text.await_args_list:
-            room = call.args[0] if call.args else call.kwargs.get("room_id")
-            target_rooms.add(room)
+        target_rooms = _target_rooms(puppet_intent.send_text)
         assert WHATSAPP_ROOM in target_rooms
 
     async def test_portal_does_not_echo_to_self(self, handler, puppet_intent):
@@ -295,10 +334,7 @@ class TestPortalToPortal:
 
         await handler.handle_message(event)
 
-        target_rooms = []
-        for call in puppet_intent.send_text.await_args_list:
-            room = call.args[0] if call.args else call.kwargs.get("room_id")
-            target_rooms.append(room)
+        target_rooms = _target_rooms(puppet_intent.send_text)
         assert SIGNAL_ROOM not in target_rooms
 
 
@@ -389,6 +425,19 @@ class TestLoopPrevention:
 
         puppet_intent.send_text.assert_not_awaited()
 
+    async def test_unrelated_room_skips_content(self, handler, puppet_intent):
+        """Events from rooms we don't relay are dropped before reading content."""
+        event = _make_message_event(
+            sender="@alice:example.com",
+            room_id="!other:example.com",
+            body="off-topic",
+        )
+        event.content = None
+
+        await handler.handle_message(event)
+
+        puppet_intent.send_text.assert_not_awaited()
+
 
 # ---------------------------------------------------------------------------
 # Fan-out resilience
@@ -445,6 +494,96 @@ class TestFanOutResilience:
         assert puppet_intent.send_text.await_count == 3
 
 
+# ---------------------------------------------------------------------------
+# Concurrent fan-out
+# ---------------------------------------------------------------------------
+
+
+class TestConcurrentFanOut:
+    """Sends to different target rooms are issued concurrently."""
+
+    async def test_portal_sends_overlap(self, handler, puppet_intent):
+        in_flight = 0
+        peak = 0
+
+        async def _slow_send(room_id, text):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            return f"$evt_{room_id}"
+
+        puppet_intent.send_text.side_effect = _slow_send
+        event = _make_message_event(
+            sender="@_signal_abc:example.com",
+            room_id=SIGNAL_ROOM,
+            body="concurrent",
+        )
+
+        await handler.handle_message(event)
+
+        # Hub + WhatsApp were both in flight at once.
+        assert peak == 2
+
+
+# ---------------------------------------------------------------------------
+# Duplicate suppression
+# ---------------------------------------------------------------------------
+
+
+class TestDuplicateSuppression:
+    """A redelivered event relays once; distinct events always relay."""
+
+    async def test_redelivered_event_suppressed(self, handler, puppet_intent):
+        event = _make_message_event(
+            sender="@nick:example.com", room_id=HUB_ROOM, body="same text",
+        )
+        await handler.handle_message(event)
+        await handler.handle_message(event)
+
+        # One fan-out to the two portals, not two.
+        assert puppet_intent.send_text.await_count == 2
+
+    async def test_identical_text_in_new_event_relayed(self, handler, puppet_intent):
+        for event_id in ("$a", "$b"):
+            await handler.handle_message(_make_message_event(
+                sender="@nick:example.com",
+                room_id=HUB_ROOM,
+                body="same text",
+                event_id=event_id,
+            ))
+
+        assert puppet_intent.send_text.await_count == 4
+
+    async def test_same_reply_to_different_messages_relayed(self, handler, puppet_intent):
+        """Two "yes" replies to two different messages are both delivered."""
+        for event_id, reply_to in (("$a", "$question1"), ("$b", "$question2")):
+            event = _make_message_event(
+                sender="@nick:example.com",
+                room_id=HUB_ROOM,
+                body="yes",
+                event_id=event_id,
+            )
+            event.content.relates_to = MagicMock()
+            event.content.relates_to.in_reply_to.event_id = reply_to
+            await handler.handle_message(event)
+
+        assert puppet_intent.send_text.await_count == 4
+
+    async def test_seen_events_bounded(self, handler, puppet_intent):
+        handler.DEDUPE_CACHE_SIZE = 2
+        for event_id in ("$a", "$b", "$c"):
+            await handler.handle_message(_make_message_event(
+                sender="@nick:example.com",
+                room_id=HUB_ROOM,
+                body="hi",
+                event_id=event_id,
+            ))
+
+        assert list(handler._seen_events) == ["$b", "$c"]
+
+
 # ---------------------------------------------------------------------------
 # Display name resolution
 # ---------------------------------------------------------------------------
@@ -503,6 +642,71 @@ class TestDisplayName:
         call = handler._puppet_manager.get_intent.await_args_list[0]
         assert call.kwargs["avatar_url"] == "mxc://example.com/avatar123"
 
+    async def test_concurrent_misses_share_one_fetch(self, handler):
+        """A burst of messages from one sender triggers a single profile fetch."""
+        results = await asyncio.gather(
+            *(
+                handler._get_sender_profile("@nick:example.com")
+                for _ in range(5)
+            ),
+        )
+
+        assert results == [("Nick", None)] * 5
+        assert handler._appservice.intent.get_profile.await_count == 1
+        assert handler._profile_inflight == {}
+
+    async def test_member_event_invalidates_cached_profile(self, handler):
+        """A profile change re-fetches instead of waiting out the TTL."""
+        await handler._get_sender_profile("@nick:example.com", WHATSAPP_ROOM)
+        await handler._get_sender_profile("@nick:example.com", WHATSAPP_ROOM)
+        assert handler._appservice.intent.get_profile.await_count == 1
+
+        member = MagicMock()
+        member.room_id = WHATSAPP_ROOM
+        member.state_key = "@nick:example.com"
+        handler.handle_member(member)
+
+        await handler._get_sender_profile("@nick:example.com", WHATSAPP_ROOM)
+        assert handler._appservice.intent.get_profile.await_count == 2
+
+    async def test_member_event_drops_in_flight_fetch(self, handler):
+        """A fetch that predates a profile change is neither shared nor cached."""
+        started = asyncio.Event()
+        release = asyncio.Event()
+        names = iter(["Old Nick", "New Nick"])
+
+        async def _get_profile(sender: str) -> FakeProfile:
+            name = next(names)
+            if name == "Old Nick":
+                started.set()
+                await release.wait()
+            return _make_profile(name)
+
+        handler._appservice.intent.get_profile.side_effect = _get_profile
+        stale = asyncio.create_task(handler._get_sender_profile("@nick:example.com"))
+        await started.wait()
+
+        member = MagicMock()
+        member.room_id = WHATSAPP_ROOM
+        member.state_key = "@nick:example.com"
+        handler.handle_member(member)
+
+        assert await handler._get_sender_profile("@nick:example.com") == ("New Nick", None)
+        release.set()
+        assert await stale == ("Old Nick", None)
+        assert handler._profile_cache[("@nick:example.com", None)][0] == "New Nick"
+        assert handler._profile_inflight == {}
+
+    async def test_profile_cache_is_bounded(self, handler):
+        handler.PROFILE_CACHE_SIZE = 2
+        for sender in ("@a:example.com", "@b:example.com", "@c:example.com"):
+            await handler._get_sender_profile(sender)
+
+        assert list(handler._profile_cache) == [
+            ("@b:example.com", None),
+            ("@c:example.com", None),
+        ]
+
 
 # ---------------------------------------------------------------------------
 # Member state scoping (hub vs portal)
@@ -583,11 +787,7 @@ class TestMediaRelay:
         await handler.handle_message(event)
 
         # Media should be sent via send_message (not send_text).
-        hub_calls = [
-            c for c in puppet_intent.send_message.await_args_list
-            if c.args and c.args[0] == HUB_ROOM
-        ]
-        assert len(hub_calls) >= 1
+        assert HUB_ROOM in _target_rooms(puppet_intent.send_message)
 
     async def test_image_from_portal_cross_relayed(self, handler, puppet_intent):
         """An image in one portal is cross-relayed to other portals."""
@@ -598,10 +798,7 @@ class TestMediaRelay:
 
         await handler.handle_message(event)
 
-        target_rooms = set()
-        for call in puppet_intent.send_message.await_args_list:
-            if call.args:
-                target_rooms.add(call.args[0])
+        target_rooms = _target_rooms(puppet_intent.send_message)
         assert SIGNAL_ROOM in target_rooms
 
     async def test_image_from_hub_fans_out_to_portals(self, handler, puppet_intent):
@@ -613,10 +810,7 @@ class TestMediaRelay:
 
         await handler.handle_message(event)
 
-        target_rooms = set()
-        for call in puppet_intent.send_message.await_args_list:
-            if call.args:
-                target_rooms.add(call.args[0])
+        target_rooms = _target_rooms(puppet_intent.send_message)
         assert WHATSAPP_ROOM in target_rooms
         assert SIGNAL_ROOM in target_rooms
 
@@ -635,6 +829,42 @@ class TestMediaRelay:
         content_arg = call.args[1]
         assert content_arg is event.content
 
+    async def test_media_reply_mapped_per_room(self, handler, puppet_intent):
+        """Concurrent media replies each point at their own room's event."""
+        content = MediaMessageEventContent(
+            msgtype=MessageType.IMAGE, body="", url="mxc://example.com/photo456",
+        )
+        content.set_reply("$question")
+        event = FakeEvent(
+            sender="@nick:example.com",
+            room_id=HUB_ROOM,
+            event_id="$media_reply",
+            content=content,
+        )
+        handler._event_map = AsyncMock()
+        handler._event_map.lookup.side_effect = (
+            lambda source, room_id: f"$question_in_{room_id}"
+        )
+        replied_to = {}
+
+        async def _send_message(room_id, send_content):
+            # Yield first, so every target's send is in flight before any
+            # of them reads its content.
+            await asyncio.sleep(0)
+            replied_to[room_id] = send_content.get_reply_to()
+            return f"$sent_in_{room_id}"
+
+        puppet_intent.send_message.side_effect = _send_message
+
+        await handler.handle_message(event)
+
+        assert replied_to == {
+            WHATSAPP_ROOM: f"$question_in_{WHATSAPP_ROOM}",
+            SIGNAL_ROOM: f"$question_in_{SIGNAL_ROOM}",
+        }
+        # The shared original still replies to the source-room event.
+        assert content.get_reply_to() == "$question"
+
     async def test_media_with_none_body_relayed(self, handler, puppet_intent):
         """Media events with body=None are still relayed (not skipped)."""
         event = _make_media_event(
@@ -755,6 +985,21 @@ class TestMalformedReactions:
 
         puppet_intent.react.assert_not_awaited()
 
+    async def test_reaction_with_missing_key(self):
+        handler, puppet_intent = _make_handler()
+        handler._event_map = AsyncMock()
+
+        event = MagicMock()
+        event.sender = "@_whatsapp_12345:example.com"
+        event.room_id = WHATSAPP_ROOM
+        event.content.relates_to.event_id = "$some_msg"
+        event.content.relates_to.key = None
+
+        await handler.handle_reaction(event)
+
+        handler._event_map.has_event.assert_not_awaited()
+        puppet_intent.react.assert_not_awaited()
+
 
 # ---------------------------------------------------------------------------
 # Double puppet resolution
@@ -768,7 +1013,7 @@ DOUBLE_PUPPET_MAP = {
 
 
 def _make_handler_with_double_puppets(
-    profiles: dict[str, MagicMock] | None = None,
+    profiles: dict[str, FakeProfile] | None = None,
 ) -> tuple[RelayHandler, AsyncMock]:
     """Build a handler with double puppet mapping configured."""
     merged_profiles = {
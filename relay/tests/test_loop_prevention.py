@@ -10,6 +10,7 @@ from __future__ import annotations
 import pytest
 
 from appservice.loop_prevention import (
+    ATTRIBUTION_RE,
     has_attribution,
     is_bridge_bot,
     is_bridge_puppet,
@@ -117,6 +118,43 @@ class TestHasAttribution:
     def test_lowercase_start(self):
         assert has_attribution("alice: not attributed") is False
 
+    def test_bold_without_platform(self):
+        assert has_attribution("**important** announcement") is False
+
+    def test_colon_without_space(self):
+        assert has_attribution("Note:no space") is False
+
+    def test_empty_body(self):
+        assert has_attribution("") is False
+
+    def test_bold_name_with_parentheses(self):
+        assert has_attribution("**Bob (Jr) (WhatsApp):** hi") is True
+
+    def test_bold_attribution_must_be_on_first_line(self):
+        assert has_attribution("**Alice\n(WhatsApp):** hello") is False
+
+    def test_pathological_bold_body(self):
+        """Many parentheses, with and without a trailing ':**' (ReDoS shape)."""
+        body = "**" + "(a)" * 50_000
+        assert has_attribution(body) is False
+        assert has_attribution(body + ":**") is True
+        assert has_attribution(body + "\n(WhatsApp):**") is False
+
+    @pytest.mark.parametrize("body", [
+        "**Alice (WhatsApp):** hello",
+        "Alice: hello from Discord relay",
+        "hello world",
+        "**important** announcement",
+        "**Bob (Jr) (WhatsApp):** hi",
+        "**Alice\n(WhatsApp):** hello",
+        "**():** hi",
+        "**" + "(a)" * 50_000 + ":**",
+        "**" + "(a)" * 50_000,
+    ])
+    def test_public_pattern_agrees(self, body: str):
+        """ATTRIBUTION_RE stays available and matches what has_attribution does."""
+        assert (ATTRIBUTION_RE.match(body) is not None) is has_attribution(body)
+
 
 # ---------------------------------------------------------------------------
 # platform_label
@@ -136,6 +174,14 @@ class TestPlatformLabel:
     def test_native_matrix_user(self):
         assert platform_label("@alice:example.com") == "Matrix"
 
+    @pytest.mark.parametrize("user_id", [
+        "@_discord:example.com",
+        "@_slack_123:example.com",
+        "@discord_123:example.com",
+    ])
+    def test_non_puppet_lookalikes(self, user_id):
+        assert platform_label(user_id) == "Matrix"
+
 
 # ---------------------------------------------------------------------------
 # should_ignore_in_portal
@@ -207,3 +253,18 @@ class TestShouldIgnoreInHub:
         assert should_ignore_in_hub(
             "@nick:example.com", "hello", BOT_MXID,
         ) is False
+
+    @pytest.mark.parametrize("user_id", [
+        "@_whatsapp_12345:example.com",
+        "@_signal_abc:example.com",
+        "@signalbot:example.com",
+        "@signalbotx:example.com",
+        "@_whatsappx_1:example.com",
+        "@_relay_whatsapp_abc:example.com",
+        "@nick:example.com",
+    ])
+    def test_agrees_with_public_helpers(self, user_id: str):
+        """The hub filter and the public predicates share one bridge rule."""
+        assert should_ignore_in_hub(user_id, "hello", BOT_MXID) is (
+            is_relay_puppet(user_id) or is_bridge_puppet(user_id)
+        )
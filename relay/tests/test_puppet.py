@@ -7,6 +7,7 @@ single join-with-profile for first entry).
 
 from __future__ import annotations
 
+import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -77,6 +78,21 @@ class TestMxidGeneration:
         assert len(hash_part) == 8
         assert all(c in "0123456789abcdef" for c in hash_part)
 
+    def test_mxid_is_stable(self, manager: PuppetManager):
+        """Existing puppets are registered under these IDs; they must not drift."""
+        mxid = manager.mxid_for("whatsapp", "@_whatsapp_12345:example.com")
+        assert mxid == f"@_relay_whatsapp_dc9ec0fc:{DOMAIN}"
+
+    def test_mxid_cache_is_bounded(self, manager: PuppetManager):
+        """The MXID memo evicts its oldest entry and still recomputes it."""
+        manager.MXID_CACHE_SIZE = 2
+        first = manager.mxid_for("whatsapp", "@a:example.com")
+        manager.mxid_for("whatsapp", "@b:example.com")
+        manager.mxid_for("whatsapp", "@c:example.com")
+        assert len(manager._mxid_cache) == 2
+        assert ("whatsapp", "@a:example.com") not in manager._mxid_cache
+        assert manager.mxid_for("whatsapp", "@a:example.com") == first
+
 
 # ---------------------------------------------------------------------------
 # Intent management
@@ -167,6 +183,108 @@ class TestGetIntent:
         assert intent.send_state_event.await_count == 1
         assert intent.ensure_joined.await_count == 1
 
+    async def test_fan_out_registers_puppet_once(self, manager: PuppetManager):
+        """Concurrent calls for one new puppet share its registration."""
+        intent = AsyncMock()
+        manager._appservice.intent.user.return_value = intent
+        rooms = [f"!room{i}:example.com" for i in range(5)]
+
+        await asyncio.gather(*(
+            manager.get_intent(
+                platform="whatsapp",
+                sender="@_whatsapp_12345:example.com",
+                display_name="Alice",
+                avatar_url="mxc://example.com/alice",
+                room_id=room,
+            )
+            for room in rooms
+        ))
+
+        manager._appservice.intent.user.assert_called_once()
+        intent.ensure_registered.assert_awaited_once()
+        intent.set_displayname.assert_awaited_once_with("Alice")
+        intent.set_avatar_url.assert_awaited_once_with("mxc://example.com/alice")
+        # Each room still gets its own join-with-profile.
+        assert intent.send_state_event.await_count == len(rooms)
+
+    async def test_concurrent_profile_change_updated_once(self, manager: PuppetManager):
+        """A renamed sender's fan-out sends one global profile update."""
+        intent = AsyncMock()
+        manager._appservice.intent.user.return_value = intent
+        rooms = [f"!room{i}:example.com" for i in range(3)]
+        kwargs = dict(platform="whatsapp", sender="@_whatsapp_12345:example.com")
+        for room in rooms:
+            await manager.get_intent(display_name="Alice", room_id=room, **kwargs)
+
+        await asyncio.gather(*(
+            manager.get_intent(display_name="Alice B.", room_id=room, **kwargs)
+            for room in rooms
+        ))
+
+        assert intent.set_displayname.await_args_list[1:] == [(("Alice B.",),)]
+        assert manager._display_names[manager.mxid_for(**kwargs)] == "Alice B."
+
+    async def test_failed_profile_update_not_cached(self, manager: PuppetManager):
+        """A failed request leaves the caches untouched so the next call retries."""
+        intent = AsyncMock()
+        intent.set_displayname.side_effect = [RuntimeError("boom"), None]
+        manager._appservice.intent.user.return_value = intent
+
+        with pytest.raises(RuntimeError):
+            await manager.get_intent(
+                platform="whatsapp",
+                sender="@_whatsapp_12345:example.com",
+                display_name="Alice",
+                room_id="!room:example.com",
+            )
+        await manager.get_intent(
+            platform="whatsapp",
+            sender="@_whatsapp_12345:example.com",
+            display_name="Alice",
+            room_id="!room:example.com",
+        )
+
+        assert intent.set_displayname.await_count == 2
+        # The join is only sent once the profile is in place.
+        assert intent.send_state_event.await_count == 1
+
+    async def test_member_profile_cache_is_bounded(self, manager: PuppetManager):
+        """The least recently used (puppet, room) entry is evicted first."""
+        manager.MEMBER_CACHE_SIZE = 2
+        intent = AsyncMock()
+        manager._appservice.intent.user.return_value = intent
+        kwargs = dict(
+            platform="whatsapp",
+            sender="@_whatsapp_12345:example.com",
+            display_name="Alice",
+        )
+
+        await manager.get_intent(room_id="!a:example.com", **kwargs)
+        await manager.get_intent(room_id="!b:example.com", **kwargs)
+        await manager.get_intent(room_id="!a:example.com", **kwargs)
+        await manager.get_intent(room_id="!c:example.com", **kwargs)
+
+        rooms = {room for _, room in manager._member_profiles}
+        assert rooms == {"!a:example.com", "!c:example.com"}
+
+    async def test_evicted_puppet_drops_profile_caches(self, manager: PuppetManager):
+        manager.PUPPET_CACHE_SIZE = 1
+        manager._appservice.intent.user.side_effect = lambda mxid: AsyncMock()
+
+        await manager.get_intent(
+            platform="whatsapp", sender="@a:example.com",
+            display_name="A", room_id="!room:example.com",
+        )
+        await manager.get_intent(
+            platform="whatsapp", sender="@b:example.com",
+            display_name="B", room_id="!room:example.com",
+        )
+
+        evicted = manager.mxid_for("whatsapp", "@a:example.com")
+        assert list(manager._intents) == [manager.mxid_for("whatsapp", "@b:example.com")]
+        assert evicted not in manager._display_names
+        assert evicted not in manager._avatar_urls
+
     async def test_caches_intent(self, manager: PuppetManager):
         """Same puppet MXID returns the same intent on subsequent calls."""
         intent = AsyncMock()
@@ -259,6 +259,20 @@ class TestUnmappedReactions:
 
         puppet_intent.react.assert_not_awaited()
 
+    async def test_unmapped_reaction_skips_profile_lookup(self, event_map: EventMap):
+        handler, puppet_intent = _make_handler(event_map)
+
+        event = _make_reaction_event(
+            sender="@_whatsapp_12345:example.com",
+            room_id=WHATSAPP_ROOM,
+            reacted_to="$unknown_msg",
+        )
+
+        await handler.handle_reaction(event)
+
+        handler._appservice.intent.get_profile.assert_not_awaited()
+        handler._appservice.intent.get_state_event.assert_not_awaited()
+
 
 # ---------------------------------------------------------------------------
 # Resilience